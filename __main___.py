@@ -5,20 +5,11 @@ from os import environ
 # of the current directory.
 load_dotenv(environ.get("ENV_PATH", ".env"))
 
-from services.redis import redis
-
 import logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
-import sys
+# Dependencies are checked by /readyz rather than on startup.
 import api 
 
-try:
-    redis.ping()
-except:
-    logging.critical("Redis service unavailable.")
-    logging.critical("Exit")
-    sys.exit(0)
-
 if __name__ == "__main__":
-    api.start()
\ No newline at end of file
+    api.start()
@@ -1,73 +1,54 @@
-from playhouse.shortcuts import model_to_dict
-from services.lnmarkets import lnmarkets
-from services.redis import redis
-from services import lnbits
-from secrets import token_hex
+from services.lnmarkets import alnmarkets
+from services.lnbits import alnbits
+from services.redis import aredis
+from services import lnbits, lnmarkets, cache, reads, quotes, routing, invoices
+from workers import webhooks, swaps, treasury, reconciler, prices, jobs
 
 from fastapi import FastAPI, Body, HTTPException, Request, Depends
-from configs import API_HOST, API_JWT_SECRET, API_PORT, SWAP_BTC_MAX, SWAP_BTC_MIN, SWAP_FIAT_MAX, SWAP_FIAT_MIN, TIME_DAY_IN_SECONDS
-from helpers import percentage, timestamp
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from configs import SERVICES_ASYNC, API_HOST, API_JWT_SECRET, API_PORT, API_WORKERS, API_LOG_LEVEL, API_FORWARDED_ALLOW_IPS, API_GRACEFUL_TIMEOUT, SWAP_BTC_MAX, SWAP_BTC_MIN, SWAP_FIAT_MAX, SWAP_FIAT_MIN, SWAP_BATCH_WINDOW, JOB_WAIT_MAX, TIME_DAY_IN_SECONDS
+from helpers import percentage, timestamp, encode_cursor, decode_cursor
 from schemas import DepositSchema, SwapSchema, UserSchema, WithdrawSchema
-from json import dumps, loads
+from functools import partial
+from datetime import datetime
+from typing import Optional
+from anyio import to_thread
 from re import sub
 
 import middlewares
+import passwords
+import telemetry
+import asyncio
+import binascii
+import exports
+import bolt11
+import health
 import database
 import uvicorn
-import bcrypt
 import jwt
 
 api = FastAPI()
+api.add_middleware(telemetry.Middleware)
+
+# Starlette's pool running the sync endpoints.
+telemetry.pool("default", lambda: telemetry.limiter_usage(to_thread.current_default_thread_limiter()))
 
 @api.post("/api/v1/lnbits/webhook")
-def lnbits_webhook(data: dict = Body(...)):
+async def lnbits_webhook(data: dict = Body(...)):
     payment_request = data.get("bolt11")
     if not (payment_request):
         raise HTTPException(400, "Payment request not found.")
 
     payment_hash = data.get("payment_hash")
-    if (lnbits.lnbits.check_invoice_status(payment_hash) == False):
-        raise HTTPException(500, "Invoice has not been paid.")
-
-    decode_invoice = lnbits.lnbits.decode_invoice(payment_request)
-    if (payment_hash != decode_invoice["payment_hash"]):
-        raise HTTPException(500, "Payment hash invalid.")
-    
-    if (data["amount"] != decode_invoice["amount_msat"]):
-        raise HTTPException(500, "Amount invalid.")
-    
-    tx = redis.get(f"stable.tx.{payment_hash}")
-    if not (tx):
-        raise HTTPException(500, "Transaction already processed.")
-    else:
-        tx = loads(tx)
-
-    username = tx["username"]
-    balance = database.Balance.select().where(
-        (database.Balance.username == username) & 
-        (database.Balance.currency == "BTC")
-    )
-    amount = int(decode_invoice["amount_msat"] / 1000)
-    if (balance.exists() == False):
-        database.Balance.create(username=username, currency="BTC", balance=amount)
-    else:
-        balance = balance.get()
-        balance_current = balance.balance
-        balance.balance = balance_current + amount
-        balance.save()      
+    if not (payment_hash):
+        raise HTTPException(400, "Payment hash not found.")
     
-    database.Transaction.create(
-        txid=payment_hash,
-        username=username,
-        destination=username, 
-        currency="BTC",
-        value=amount,
-        status="settled",
-        typeof="deposit"
-    )
+    # Deliveries are settled by the webhook workers.
+    await webhooks.enqueue(payment_hash)
     
 @api.post("/api/create")
-def create_user(data: UserSchema):
+async def create_user(data: UserSchema):
     username = sub("[^a-zA-Z0-9 \n\.]", "", data.username)
     password = data.password
     if (len(username) < 8) or (len(password) > 64):
@@ -76,15 +57,19 @@ def create_user(data: UserSchema):
     if (len(password) < 8) or (len(password) > 64):
         raise HTTPException(400, "Password is invalid.")
 
-    if (database.User.select(database.User.username).where(database.User.username == username).exists() == True):
+    if (await database.run(database.User.select(database.User.username).where(database.User.username == username).exists) == True):
         raise HTTPException(401, "Unable to create account.")
     
-    hashed_password = bcrypt.hashpw(password=password.encode(), salt=bcrypt.gensalt())
-    database.User.create(username=username, password=hashed_password)
+    try:
+        hashed_password = await passwords.hash_password(password)
+    except passwords.QueueFull:
+        raise HTTPException(503, "Too many requests, try again later.")
+    
+    await database.run(partial(database.User.create, username=username, password=hashed_password))
     return { "message": "User created successfully." }
 
 @api.post("/api/auth")
-def auth_user(data: UserSchema):
+async def auth_user(data: UserSchema, request: Request):
     username = sub("[^a-zA-Z0-9 \n\.]", "", data.username)
     password = data.password
     if (len(username) < 8) or (len(password) > 64):
@@ -93,27 +78,30 @@ def auth_user(data: UserSchema):
     if (len(password) < 8) or (len(password) > 64):
         raise HTTPException(400, "Password is invalid.")
     
-    user = database.User.select().where((database.User.username == username))
-    if (user.exists() == False):
+    await middlewares.rateLimit(request, "auth", username)
+    
+    user = await database.run(database.User.get_or_none, database.User.username == username)
+    if (user == None):
         raise HTTPException(401)
-    else:
-        user = user.get()
 
     hashed_password = user.password
-    if (bcrypt.checkpw(password.encode(), hashed_password.encode()) == False):
+    try:
+        checked = await passwords.check_password(password, hashed_password)
+    except passwords.QueueFull:
+        raise HTTPException(503, "Too many requests, try again later.")
+    
+    if (checked == False):
         raise HTTPException(401)
     else:
         exp = timestamp() + TIME_DAY_IN_SECONDS
         token = jwt.encode(payload={ "username": username, "exp": exp }, key=API_JWT_SECRET, algorithm="HS256")
         return { "token": token, "exp": exp }    
 
-@api.post("/api/swap")
-def create_swap(data: SwapSchema, request: Request = Depends(middlewares.isAuthorization)):
-    currency = data.currency
+def validate_swap(currency: str, value: float) -> tuple:
+    """Check a swap into `currency`, returns the input asset and amount."""
     if not (currency in ["USD", "BTC"]):
         raise HTTPException(500, "Currency is invalid.")
     
-    value = data.value
     if (value <= 0):
         raise HTTPException(500, f"Value is less than or equal to zero.")
     
@@ -135,139 +123,200 @@ def create_swap(data: SwapSchema, request: Request = Depends(middlewares.isAutho
         
         if (value < SWAP_FIAT_MIN):
             raise HTTPException(500, f"Value is less than $ {SWAP_FIAT_MIN}.")
+    return (in_asset, value)
+
+def public_job(job: dict) -> dict:
+    job = dict(job)
+    job.pop("params", None)
+    return job
+
+async def respond_job(request: Request, jobid: str):
+    """Answer with the outcome of a job, or with the job itself (202) when
+    the client prefers not to wait or it is still running.
+    """
+    if ("respond-async" in request.headers.get("prefer", "")):
+        job = await jobs.get(jobid)
+    else:
+        job = await jobs.get(jobid, JOB_WAIT_MAX)
+    
+    if (job["status"] == "settled"):
+        return job["result"]
     
+    if (job["status"] == "failed"):
+        raise HTTPException(500, job["error"])
+    return JSONResponse(jsonable_encoder(public_job(job)), status_code=202, headers={ "Location": f"/api/jobs/{jobid}" })
+
+@api.get("/api/jobs/{jobid}")
+async def get_job(jobid: str, wait: float = 0, request: Request = Depends(middlewares.isAuthorization)):
+    job = await jobs.get(jobid, min(max(wait, 0), JOB_WAIT_MAX))
+    if (job == None) or (job["username"] != request.data["username"]):
+        raise HTTPException(404, "Job not found.")
+    return public_job(job)
+
+async def get_price() -> float:
+    """Current index price, answers 503 while the feed is unavailable."""
+    try:
+        return await prices.get_index()
+    except Exception:
+        raise HTTPException(503, "Price is unavailable.")
+
+@api.get("/api/quote")
+async def get_quote(currency: str, value: float, request: Request = Depends(middlewares.isAuthorization)):
+    in_asset, value = validate_swap(currency, value)
+    return quotes.create(request.data["username"], in_asset, currency, value, await get_price())
+
+@api.post("/api/swap")
+@reads.invalidates
+async def create_swap(data: SwapSchema, request: Request = Depends(middlewares.isAuthorization)):
+    await middlewares.rateLimit(request, "swap", request.data["username"])
+    
+    currency = data.currency
+    in_asset, value = validate_swap(currency, data.value)
     username = request.data["username"]
-    balance_in_asset = database.Balance.select().where((database.Balance.username == username) & (database.Balance.currency == in_asset))
-    if (balance_in_asset.exists() == False):
-        database.Balance.create(username=username, currency=in_asset)
-        raise HTTPException(500, "You don't have enough balance.")
-    else:
-        balance_in_asset = balance_in_asset.get()
-
-    balance_in_asset_current = balance_in_asset.balance
-    if (value > balance_in_asset_current):
-        raise HTTPException(500, "You don't have enough balance.") 
-
-    lnmarkets_balance = loads(lnmarkets.get_user())["balance"] 
-    fee_sat = 0
-    if (value > lnmarkets_balance):
-        fee_sat = round(percentage(value - lnmarkets_balance, 1))
-        if ((value + fee_sat) > balance_in_asset_current):
-            raise HTTPException(500, "You don't have enough balance.") 
-        
-        balance_in_asset.balance = balance_in_asset_current - (value + fee_sat)
-        balance_in_asset.save()
-        
-        payment_request = loads(lnmarkets.deposit({ "amount": (value - lnmarkets_balance) }))["paymentRequest"]
-        pay_invoice = lnbits.pay_invoice(payment_request)
-        if (pay_invoice.get("message")):
-            balance_in_asset.balance = balance_in_asset_current
-            balance_in_asset.save()                
-            raise HTTPException(500, "It was not possible to swap the exchange.")
-        else:
-            fee_sat = pay_invoice["fee_sat"]
-            balance_in_asset.balance = balance_in_asset_current - (value + fee_sat)
-            balance_in_asset.save()
-    else:
-        balance_in_asset.balance = balance_in_asset_current - value
-        balance_in_asset.save()
-    
-    swap = lnmarkets.swap( { "in_asset": in_asset, "out_asset": currency, "in_amount": value } )
-    if not (swap):
-        balance_in_asset.balance = balance_in_asset_current
-        balance_in_asset.save()
-        raise HTTPException(500, "It was not possible to swap the exchange.")
-    else:
-        swap = loads(swap)
     
-    if not (swap.get("exchange_rate")):
-        balance_in_asset.balance = balance_in_asset_current
-        balance_in_asset.save()
-        raise HTTPException(500, "It was not possible to swap the exchange.")
+    quote = None
+    if (data.quote):
+        try:
+            quote = quotes.verify(data.quote, username, currency, value, await get_price())
+        except quotes.QuoteError as error:
+            raise HTTPException(400, str(error))
+        
+        if not (await quotes.claim(quote)):
+            raise HTTPException(400, "Quote was already used.")
     
-    out_amount = float(swap["out_amount"])
-    balance_out_asset = database.Balance.select().where((database.Balance.username == username) & (database.Balance.currency == currency))
-    if (balance_out_asset.exists() == False):
-        database.Balance.create(username=username, currency=currency, balance=out_amount)
-    else:
-        balance_out_asset = balance_out_asset.get()
-        balance_out_asset.balance = balance_out_asset.balance + out_amount
-        balance_out_asset.save()
+    # A swap that is never submitted gives its quote back.
+    jobid = None
+    try:
+        quoted = quote["out_amount"] if (quote) else None
+        if (SWAP_BATCH_WINDOW > 0):
+            # Reserve the worst case routing fee, the batch returns what is unused.
+            fee_sat = round(percentage(value, 1)) if (in_asset == "BTC") else 0
+            params = { "out_asset": currency, "value": value, "quoted": quoted, "fee_sat": fee_sat, "top_up": 0 }
+            jobid = await jobs.submit(username, "swap", "batched", params, in_asset, database.to_units(in_asset, value + fee_sat))
+        else:
+            lnmarkets_balance = await lnmarkets.get_balance()
+            top_up = max(value - lnmarkets_balance, 0)
+            fee_sat = round(percentage(top_up, 1)) if (top_up) else 0
+            params = { "out_asset": currency, "value": value, "quoted": quoted, "fee_sat": fee_sat, "top_up": top_up }
+            jobid = await jobs.submit(username, "swap", "debited", params, in_asset, database.to_units(in_asset, value + fee_sat))
+    finally:
+        if (jobid == None) and (quote):
+            await quotes.release(quote)
     
-    database.Transaction.create(
-        txid=token_hex(32),
-        username=username,
-        destination=username,
-        currency=in_asset,
-        fee=fee_sat,
-        value=value,
-        status="settled",
-        typeof="withdraw"
-    )
-    database.Transaction.create(
-        txid=token_hex(32),
-        username=username,
-        destination=username, 
-        currency=currency,
-        value=out_amount,
-        status="settled",
-        typeof="deposit"
-    )
-    return { "coins": out_amount, "currency": currency }
+    if (jobid == None):
+        raise HTTPException(500, "You don't have enough balance.")
+    return await respond_job(request, jobid)
 
 @api.get("/api/balance")
-def get_balance(currency: str = "BTC", request: Request = Depends(middlewares.isAuthorization)):
+async def get_balance(currency: str = "BTC", request: Request = Depends(middlewares.isAuthorization)):
     currency = currency.upper()
     if not (currency in ["USD", "BTC"]):
         raise HTTPException(500, "Currency is invalid.")
     
     username = request.data["username"]
-    balance = database.Balance.select(database.Balance.balance).where((database.Balance.username == username) & (database.Balance.currency == currency))
-    if (balance.exists() == False):
-        return { "balance": 0 }
-    else:
-        balance = balance.get().balance
-        return { "balance": balance }
+    def load():
+        balance = database.Balance.select(database.Balance.balance).where((database.Balance.username == username) & (database.Balance.currency == currency))
+        if (balance.exists() == False):
+            return { "balance": 0 }
+        else:
+            balance = balance.get().balance
+            return { "balance": database.from_units(currency, balance) }
+    
+    return await reads.get(request, username, f"balance.{currency}", load)
 
 @api.get("/api/balances")
-def get_all_balances(request: Request = Depends(middlewares.isAuthorization)):
+async def get_all_balances(request: Request = Depends(middlewares.isAuthorization)):
     username = request.data["username"]
-    balances = {}
-    for balance in database.Balance.select(database.Balance.balance, database.Balance.currency).where(database.Balance.username == username):
-        balances[balance.currency] = balance.balance
-    return balances
+    def load():
+        balances = {}
+        for balance in database.Balance.select(database.Balance.balance, database.Balance.currency).where(database.Balance.username == username):
+            balances[balance.currency] = database.from_units(balance.currency, balance.balance)
+        return balances
+    
+    return await reads.get(request, username, "balances", load)
 
 @api.get("/api/transaction/{txid}")
-def get_transaction(txid: str, request: Request = Depends(middlewares.isAuthorization)):
+async def get_transaction(txid: str, request: Request = Depends(middlewares.isAuthorization)):
     username = request.data["username"]
-    tx = database.Transaction.select().where((database.Transaction.username == username) & (database.Transaction.txid == txid))
-    if (tx.exists() == False):
-        raise HTTPException(500, "Tx does not exist.")
-    else:
-        tx = tx.get()
-        tx = model_to_dict(tx)
-        tx["type"] = tx["typeof"]
-        del tx["id"]
-        del tx["typeof"]
-        return tx
+    def load():
+        tx = database.Transaction.select().where((database.Transaction.username == username) & (database.Transaction.txid == txid))
+        if (tx.exists() == False):
+            raise HTTPException(500, "Tx does not exist.")
+        else:
+            return tx.get().to_dict()
+    
+    # Settled transactions are immutable.
+    return await reads.get(request, username, f"transaction.{txid}", load, final=lambda tx: (tx["status"] == "settled"))
+
+def parse_cursor(cursor: str) -> tuple:
+    """(created_at, id) position of a pagination cursor, answers 400 when
+    it is invalid.
+    """
+    try:
+        return decode_cursor(cursor)
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(400, "Cursor is invalid.")
 
 @api.get("/api/transactions")
-def get_list_transactions(offset: int = 0, limit: int = 10, request: Request = Depends(middlewares.isAuthorization)):
+async def get_list_transactions(offset: int = 0, limit: int = 10, cursor: Optional[str] = None, request: Request = Depends(middlewares.isAuthorization)):
     username = request.data["username"]
-    txs = []
     if (limit > 10):
         raise HTTPException(500, "The limit must be less than 10.")
     
-    for tx in database.Transaction.select().order_by(database.Transaction.created_at).where((database.Transaction.username == username)).limit(limit).offset(offset):
-        tx = model_to_dict(tx)
-        tx["type"] = tx["typeof"]
-        del tx["id"]
-        del tx["typeof"]
-        txs.append(tx)
-    return txs
+    if (cursor == None):
+        def load():
+            txs = []
+            for tx in database.Transaction.select().order_by(database.Transaction.created_at).where((database.Transaction.username == username)).limit(limit).offset(offset):
+                txs.append(tx.to_dict())
+            return txs
+        
+        return await reads.get(request, username, f"transactions.{offset}.{limit}", load)
+    
+    # Keyset pagination, an empty cursor requests the first page.
+    query = database.Transaction.select().where(database.Transaction.username == username)
+    if (cursor):
+        created_at, id = parse_cursor(cursor)
+        query = query.where(
+            (database.Transaction.created_at > created_at) | 
+            ((database.Transaction.created_at == created_at) & (database.Transaction.id > id))
+        )
+    
+    def load():
+        txs = []
+        rows = list(query.order_by(database.Transaction.created_at, database.Transaction.id).limit(limit + 1))
+        next_cursor = None
+        if (len(rows) > limit):
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+        
+        for tx in rows:
+            txs.append(tx.to_dict())
+        return { "transactions": txs, "next_cursor": next_cursor }
+    
+    return await reads.get(request, username, f"transactions.{limit}.{cursor}", load)
+
+@api.get("/api/transactions/export")
+async def export_transactions(format: str = "ndjson", since: Optional[str] = None, until: Optional[str] = None, cursor: Optional[str] = None, request: Request = Depends(middlewares.isAuthorization)):
+    if not (format in exports.FORMATS):
+        raise HTTPException(400, "Format is invalid.")
+    
+    # ISO dates or datetimes, since is inclusive and until exclusive.
+    try:
+        since = datetime.fromisoformat(since) if (since) else None
+        until = datetime.fromisoformat(until) if (until) else None
+    except ValueError:
+        raise HTTPException(400, "Date is invalid.")
+    
+    if (cursor):
+        parse_cursor(cursor)
+    
+    username = request.data["username"]
+    await middlewares.rateLimit(request, "export", username)
+    return StreamingResponse(exports.stream(username, format, since, until, cursor), media_type=exports.FORMATS[format])
 
 @api.post("/api/deposit")
-def deposit(data: DepositSchema, request: Request = Depends(middlewares.isAuthorization)):
+@reads.invalidates
+async def deposit(data: DepositSchema, request: Request = Depends(middlewares.isAuthorization)):
     value = data.value
     if (value < 1):
         raise HTTPException(500, "Value is invalid.")
@@ -276,124 +325,148 @@ def deposit(data: DepositSchema, request: Request = Depends(middlewares.isAuthor
     if (len(description) > 64):
         raise HTTPException(500, "Description is greater than 64 characters.")
     
-    payment_request = lnbits.create_invoice(value, description)
+    payment_request = await lnbits.create_invoice(value, description)
     if (payment_request.get("message")):
         raise HTTPException(500, payment_request["message"])
 
     payment_hash = payment_request["payment_hash"]
     username = request.data["username"]
-    expiry = payment_request["expiry"]
-    redis.set(f"stable.tx.{payment_hash}", dumps({
-        "txid":      payment_hash,
-        "username":  username,
-        "currency":  "BTC",
-        "status":    "pending",
-        "type":      "deposit",
-        "created_at": timestamp() 
-    }))
-    redis.expire(f"stable.tx.{payment_hash}", expiry)
+    await database.run(partial(database.Transaction.create,
+        txid=payment_hash,
+        username=username,
+        destination=username,
+        currency="BTC",
+        value=database.to_units("BTC", value),
+        status="pending",
+        typeof="deposit",
+        description=description
+    ))
     return payment_request
 
 @api.post("/api/withdraw")
-def withdraw(data: WithdrawSchema, request: Request = Depends(middlewares.isAuthorization)):
+@reads.invalidates
+async def withdraw(data: WithdrawSchema, request: Request = Depends(middlewares.isAuthorization)):
+    await middlewares.rateLimit(request, "withdraw", request.data["username"])
+    
     payment_request = data.payment_request
     try:
-        decode_invoice = lnbits.lnbits.decode_invoice(payment_request)
-    except:
-        raise HTTPException(500, "Invoice is invalid.")
+        decode_invoice = await invoices.decode(payment_request)
+    except bolt11.InvoiceError as error:
+        raise HTTPException(500, str(error))
     
-    amount_sat = int(decode_invoice["amount_msat"] / 1000)
+    amount_sat = int((decode_invoice["amount_msat"] or 0) / 1000)
     if (amount_sat < 1):
         raise HTTPException(500, "Value must be greater than or equal to 1 sats.")
     
     username = request.data["username"]
-    balance = database.Balance.select().where(
-        (database.Balance.username == username) & 
-        (database.Balance.currency == "BTC") & 
-        (database.Balance.balance > amount_sat)
-    )
-    if (balance.exists() == False):
-        raise HTTPException(500, "You don't have enough balance.")
-    else:
-        balance = balance.get()
-    
-    balance_current = balance.balance
-    if (amount_sat > balance_current):
-        raise HTTPException(500, "You don't have enough balance.")
-
-    lnmarkets_balance = loads(lnmarkets.get_user())["balance"] 
-    lnbits_balance = round(lnbits.lnbits.get_wallet()["balance"] / 1000)
     fee_sat = round(percentage(amount_sat, 1))
-    if ((amount_sat + fee_sat) > balance_current):
-        raise HTTPException(500, "You don't have enough balance.") 
-    
-    balance.balance = balance_current - (amount_sat + fee_sat)
-    balance.save()
-
-    if (lnbits_balance > amount_sat):
-        pay = lnbits.lnbits.pay_invoice(payment_request)
-        if not (pay):
-            balance.balance = balance_current
-            balance.save()
-            raise HTTPException(500, "Unable to pay invoice.")
-
-        payment_hash = pay.get("payment_hash")
-    elif (lnmarkets_balance > amount_sat) and (amount_sat >= 1000):
-        pay = lnmarkets.withdraw( { "invoice": payment_request } )
-        if not (pay):
-            balance.balance = balance_current
-            balance.save()
-            raise HTTPException(500, "Unable to pay invoice.")
-        else:
-            pay = loads(pay)
-        
-        payment_hash = pay.get("payment_hash")
-    else:
-        balance.balance = balance_current
-        balance.save()
-        raise HTTPException(500, "Unable to pay invoice.")
+    debited = database.to_units("BTC", amount_sat + fee_sat)
     
-    if not (payment_hash):
-        balance.balance = balance_current
-        balance.save()
-        raise HTTPException(500, "Unable to pay invoice.")
+    # The debit and the choice of the paying wallet run side by side.
+    params = { "payment_request": payment_request, "payment_hash": decode_invoice["payment_hash"], "amount_sat": amount_sat, "fee_sat": fee_sat }
+    job, wallet = await asyncio.gather(jobs.create(username, "withdraw", "debited", params, "BTC", debited), routing.plan(amount_sat))
+    if (job == None):
+        raise HTTPException(500, "You don't have enough balance.")
     
-    tx = database.Transaction.create(
-        txid=payment_hash,
-        username=username,
-        destination=username,
-        currency="BTC",
-        value=amount_sat,
-        fee=fee_sat,
-        status="settled",
-        typeof="withdraw"
-    )
-    tx = model_to_dict(tx)
-    tx["type"] = tx["typeof"]
-    del tx["id"]
-    del tx["typeof"]
-    return tx
+    job["params"]["wallet"] = wallet
+    return await respond_job(request, jobs.launch(job))
 
-def start():
-    uvicorn.run(api, host=API_HOST, port=API_PORT, log_config={
-        "version": 1,
-        "disable_existing_loggers": False,
-        "formatters": {
-            "default": {
-                "()": "uvicorn.logging.DefaultFormatter",
-                "fmt": "%(levelprefix)s %(asctime)s %(message)s",
-                "datefmt": "%Y-%m-%d %H:%M:%S",
-
-            },
+@api.get("/api/admin/treasury")
+async def get_treasury(request: Request = Depends(middlewares.isAdmin)):
+    return await treasury.get_state()
+
+@api.post("/api/admin/treasury/rebalance")
+async def rebalance_treasury(request: Request = Depends(middlewares.isAdmin)):
+    return await treasury.rebalance()
+
+@api.get("/api/v1/cache/metrics")
+def get_cache_metrics():
+    return cache.metrics()
+
+@api.get("/api/v1/auth/metrics")
+def get_auth_metrics():
+    return { "bcrypt": dict(passwords.metrics), "tokens": dict(middlewares.metrics) }
+
+@api.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(telemetry.render(), media_type="text/plain; version=0.0.4")
+
+@api.get("/healthz")
+async def get_health():
+    return { "status": "ok" }
+
+@api.get("/readyz")
+async def get_readiness():
+    readiness = await health.readiness()
+    return JSONResponse(readiness, status_code=200 if (readiness["ready"]) else 503)
+
+@api.on_event("startup")
+async def startup():
+    database.prepare()
+    await database.run(database.setup)
+    webhooks.start()
+    prices.start()
+    treasury.start()
+    reconciler.start()
+    jobs.start()
+
+@api.on_event("shutdown")
+async def shutdown():
+    await jobs.stop()
+    await swaps.stop()
+    await webhooks.stop()
+    await prices.stop()
+    await treasury.stop()
+    await reconciler.stop()
+    if (SERVICES_ASYNC == True):
+        await alnbits.close()
+        await alnmarkets.close()
+        await aredis.close()
+
+LOG_CONFIG = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {
+            "()": "uvicorn.logging.DefaultFormatter",
+            "fmt": "%(levelprefix)s %(asctime)s %(message)s",
+            "datefmt": "%Y-%m-%d %H:%M:%S",
+        },
+        "access": {
+            "()": "uvicorn.logging.AccessFormatter",
+            "fmt": "%(levelprefix)s %(asctime)s %(client_addr)s - \"%(request_line)s\" %(status_code)s",
+            "datefmt": "%Y-%m-%d %H:%M:%S",
         },
-        "handlers": {
-            "default": {
-                "formatter": "default",
-                "class": "logging.StreamHandler",
-                "stream": "ext://sys.stderr",
-            },
+    },
+    "handlers": {
+        "default": {
+            "formatter": "default",
+            "class": "logging.StreamHandler",
+            "stream": "ext://sys.stderr",
         },
-        "loggers": {
-            "foo-logger": {"handlers": ["default"], "level": "DEBUG"},
+        "access": {
+            "formatter": "access",
+            "class": "logging.StreamHandler",
+            "stream": "ext://sys.stdout",
         },
-    })
\ No newline at end of file
+    },
+    "loggers": {
+        "uvicorn": { "handlers": ["default"], "level": API_LOG_LEVEL.upper(), "propagate": False },
+        "uvicorn.access": { "handlers": ["access"], "level": API_LOG_LEVEL.upper(), "propagate": False },
+    },
+}
+
+def start():
+    """Serve the API with `API_WORKERS` processes. On SIGTERM every worker
+    stops accepting connections and gives in-flight requests up to 
+    `API_GRACEFUL_TIMEOUT` seconds before running the shutdown hooks.
+    """
+    uvicorn.run("api:api", 
+        host=API_HOST, 
+        port=API_PORT, 
+        workers=API_WORKERS,
+        proxy_headers=True,
+        forwarded_allow_ips=API_FORWARDED_ALLOW_IPS,
+        timeout_graceful_shutdown=API_GRACEFUL_TIMEOUT,
+        log_config=LOG_CONFIG
+    )
@@ -0,0 +1,111 @@
+"""Compare the local BOLT11 decoder with decoding through the LNbits
+HTTP endpoint. Its correctness is checked by tests/test_bolt11.py.
+
+    python benchmarks/decode.py --invoices 200 --latency 20
+    python benchmarks/decode.py --iterations 2000 --json decode.json
+
+The HTTP path runs against the LNbits stand-in of benchmarks/mocks.py.
+"""
+
+from time import perf_counter
+from json import dumps
+from os import environ, path
+
+import argparse
+import asyncio
+import socket
+import sys
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app modules read their configuration on import.
+for name in ["API_JWT_SECRET", "LNM_KEY", "LNM_SECRET", "LNM_PASSPHRASE", "LNBITS_WALLET_ADMIN_KEY", "LNBITS_WALLET_INVOICE_KEY"]:
+    environ.setdefault(name, "bench")
+
+from services.lnbits import LnbitsAsync
+from services import invoices
+from tests.test_bolt11 import VECTORS
+
+import bolt11
+import mocks
+
+def percentile(values: list, p: float) -> float:
+    if not (values):
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1)]
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "samples": len(samples),
+        "p50": round(percentile(samples, 50) * 1e6, 1),
+        "p99": round(percentile(samples, 99) * 1e6, 1),
+        "mean": round(sum(samples) / len(samples) * 1e6, 1)
+    }
+
+async def measure_http(port: int, payment_requests: list) -> list:
+    client = LnbitsAsync(admin_key="bench", invoice_key="bench", url=f"http://127.0.0.1:{port}/api")
+    samples = []
+    try:
+        for payment_request in payment_requests:
+            start = perf_counter()
+            await client.decode_invoice(payment_request)
+            samples.append(perf_counter() - start)
+    finally:
+        await client.close()
+    return samples
+
+async def measure_cached(payment_requests: list, iterations: int) -> list:
+    samples = []
+    for i in range(iterations):
+        payment_request = payment_requests[i % len(payment_requests)]
+        start = perf_counter()
+        await invoices.decode(payment_request)
+        samples.append(perf_counter() - start)
+    return samples
+
+def measure(function, payment_requests: list, iterations: int) -> list:
+    samples = []
+    for i in range(iterations):
+        payment_request = payment_requests[i % len(payment_requests)]
+        start = perf_counter()
+        function(payment_request)
+        samples.append(perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--invoices", type=int, default=200, help="distinct invoices decoded")
+    parser.add_argument("--iterations", type=int, default=2000, help="decodes measured on the cached path")
+    parser.add_argument("--latency", type=float, default=20, help="mean LNbits latency in milliseconds")
+    parser.add_argument("--json", default="", help="write the report to this file")
+    args = parser.parse_args()
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    state = mocks.State()
+    mocks.serve(mocks.LnbitsHandler, port, state, args.latency)
+    payment_requests = [state.create_invoice(1000 * (i + 1), "bench")["payment_request"] for i in range(args.invoices)]
+
+    bolt11.decode(payment_requests[0])
+    invoices.invoices.clear()
+    report = {
+        "http": summarize(asyncio.run(measure_http(port, payment_requests))),
+        "local": summarize(measure(bolt11.decode, payment_requests, len(payment_requests))),
+        "spec": summarize(measure(bolt11.decode, [payment_request for payment_request, _ in VECTORS], len(VECTORS) * 20)),
+        "cached": summarize(asyncio.run(measure_cached(payment_requests, args.iterations)))
+    }
+
+    print(f"{'path':<10}{'samples':>10}{'p50 us':>12}{'p99 us':>12}{'mean us':>12}")
+    for name, stats in report.items():
+        print(f"{name:<10}{stats['samples']:>10}{stats['p50']:>12}{stats['p99']:>12}{stats['mean']:>12}")
+
+    if (args.json):
+        with open(args.json, "w") as file:
+            file.write(dumps(report, indent=2))
+
+if (__name__ == "__main__"):
+    main()
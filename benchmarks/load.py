@@ -0,0 +1,273 @@
+"""Load test the API against local LNbits and LN Markets stand-ins and
+report throughput and p50/p95/p99 latency per endpoint.
+
+    python benchmarks/load.py --concurrency 100 --requests 5000 --latency 50
+    python benchmarks/load.py --users 200 --mix balance=60,balances=20,transactions=15,swap=5
+    python benchmarks/load.py --redis-server redis-server --max-p99 swap=800,withdraw=800 --json report.json
+
+The app runs under uvicorn in a subprocess with a throwaway SQLite
+database. Redis is taken from REDIS_HOST/REDIS_PORT unless a
+redis-server binary is given to start a private instance.
+"""
+
+from tempfile import TemporaryDirectory
+from secrets import token_hex
+from json import dumps
+from time import perf_counter, sleep
+from os import environ, path
+
+import subprocess
+import argparse
+import asyncio
+import random
+import socket
+import httpx
+import sys
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+
+# Relative weight of every operation in the mixed workload.
+WORKLOAD = {
+    "balance": 30,
+    "balances": 10,
+    "transactions": 10,
+    "auth": 5,
+    "deposit": 15,
+    "webhook": 10,
+    "swap": 12,
+    "withdraw": 8
+}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_port(port: int, timeout: float = 30):
+    deadline = perf_counter() + timeout
+    while (perf_counter() < deadline):
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            sleep(0.1)
+    raise TimeoutError(f"Nothing listening on port {port}.")
+
+def percentile(values: list, p: float) -> float:
+    if not (values):
+        return 0
+    return values[min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1)]
+
+class Runner:
+    def __init__(self, client: httpx.AsyncClient, lnbits: httpx.AsyncClient, users: list):
+        self.client = client
+        self.lnbits = lnbits
+        self.users = users
+        self.samples = { name: [] for name in WORKLOAD }
+        self.errors = { name: 0 for name in WORKLOAD }
+        self.invoices = []
+
+    async def timed(self, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        start = perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        
+        self.samples[name].append((perf_counter() - start) * 1000)
+        if (response.status_code >= 400):
+            self.errors[name] += 1
+        return response
+
+    async def operation(self, name: str):
+        user = random.choice(self.users)
+        headers = { "Authorization": f"Bearer {user['token']}" }
+        if (name == "balance"):
+            await self.timed(name, "GET", "/api/balance", headers=headers)
+        elif (name == "balances"):
+            await self.timed(name, "GET", "/api/balances", headers=headers)
+        elif (name == "transactions"):
+            await self.timed(name, "GET", "/api/transactions", params={ "cursor": "" }, headers=headers)
+        elif (name == "auth"):
+            await self.timed(name, "POST", "/api/auth", json={ "username": user["username"], "password": user["password"] })
+        elif (name == "deposit"):
+            response = await self.timed(name, "POST", "/api/deposit", json={ "value": random.randint(1000, 10000) }, headers=headers)
+            if (response != None) and (response.status_code == 200):
+                self.invoices.append(response.json()["payment_hash"])
+        elif (name == "webhook"):
+            if not (self.invoices):
+                return
+            
+            payment_hash = self.invoices.pop()
+            payment = (await self.lnbits.post(f"/mock/pay/{payment_hash}")).json()
+            await self.timed(name, "POST", "/api/v1/lnbits/webhook", json={ 
+                "payment_hash": payment_hash, 
+                "bolt11": f"lnmock{payment['amount']}x{payment_hash}", 
+                "amount": payment["amount"] 
+            })
+        elif (name == "swap"):
+            if (random.random() < 0.5):
+                data = { "currency": "USD", "value": random.randint(1000, 5000) }
+            else:
+                data = { "currency": "BTC", "value": round(random.uniform(0.5, 2), 2) }
+            await self.timed(name, "POST", "/api/swap", json=data, headers=headers)
+        elif (name == "withdraw"):
+            invoice = (await self.lnbits.post("/api/v1/payments", json={ "out": False, "amount": random.randint(1000, 5000) })).json()
+            await self.timed(name, "POST", "/api/withdraw", json={ "payment_request": invoice["payment_request"] }, headers=headers)
+
+    async def worker(self, count: int):
+        names = list(WORKLOAD.keys())
+        weights = list(WORKLOAD.values())
+        for _ in range(count):
+            await self.operation(random.choices(names, weights)[0])
+
+async def setup(client: httpx.AsyncClient, lnbits: httpx.AsyncClient, count: int) -> list:
+    """Create users and fund them through the regular deposit flow."""
+    users = []
+    for _ in range(count):
+        user = { "username": f"bench{token_hex(6)}", "password": token_hex(8) }
+        await client.post("/api/create", json=user)
+        user["token"] = (await client.post("/api/auth", json=user)).json()["token"]
+        headers = { "Authorization": f"Bearer {user['token']}" }
+        
+        deposit = (await client.post("/api/deposit", json={ "value": 1000000 }, headers=headers)).json()
+        payment = (await lnbits.post(f"/mock/pay/{deposit['payment_hash']}")).json()
+        await client.post("/api/v1/lnbits/webhook", json={ 
+            "payment_hash": deposit["payment_hash"], 
+            "bolt11": deposit["payment_request"], 
+            "amount": payment["amount"] 
+        })
+        users.append(user)
+    
+    # Wait for the webhook workers, then give every user some USD.
+    for user in users:
+        headers = { "Authorization": f"Bearer {user['token']}" }
+        for _ in range(100):
+            if ((await client.get("/api/balance", headers=headers)).json()["balance"] > 0):
+                break
+            await asyncio.sleep(0.1)
+        await client.post("/api/swap", json={ "currency": "USD", "value": 200000 }, headers=headers)
+    return users
+
+async def run(args, api_port: int, lnbits_port: int) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", limits=limits, timeout=60) as client, \
+        httpx.AsyncClient(base_url=f"http://127.0.0.1:{lnbits_port}", limits=limits, timeout=60) as lnbits:
+        users = await setup(client, lnbits, args.users)
+        runner = Runner(client, lnbits, users)
+        
+        start = perf_counter()
+        per_worker = args.requests // args.concurrency
+        await asyncio.gather(*[runner.worker(per_worker) for _ in range(args.concurrency)])
+        elapsed = perf_counter() - start
+    
+    report = { "elapsed": round(elapsed, 3), "concurrency": args.concurrency, "endpoints": {} }
+    for name, samples in runner.samples.items():
+        samples.sort()
+        report["endpoints"][name] = {
+            "requests": len(samples),
+            "errors": runner.errors[name],
+            "rps": round(len(samples) / elapsed, 1),
+            "p50": round(percentile(samples, 50), 2),
+            "p95": round(percentile(samples, 95), 2),
+            "p99": round(percentile(samples, 99), 2),
+            "max": round(samples[-1], 2) if (samples) else 0
+        }
+    return report
+
+def print_report(report: dict):
+    print(f"{'endpoint':<14}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, stats in report["endpoints"].items():
+        print(f"{name:<14}{stats['requests']:>10}{stats['errors']:>8}{stats['rps']:>10}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}{stats['max']:>10}")
+    print(f"\n{sum([stats['requests'] for stats in report['endpoints'].values()])} requests in {report['elapsed']}s at concurrency {report['concurrency']}.")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=20, help="mean upstream latency in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of upstream requests answered with a 500")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--redis-server", default="", help="redis-server binary to start a private instance")
+    parser.add_argument("--json", default="", help="write the report to this file")
+    parser.add_argument("--max-p99", default="", help="fail when exceeded, e.g. swap=800,withdraw=800")
+    parser.add_argument("--mix", default="", help="override workload weights, e.g. balance=80,swap=20")
+    args = parser.parse_args()
+
+    if (args.mix):
+        WORKLOAD.clear()
+        for weight in args.mix.split(","):
+            name, value = weight.split("=")
+            WORKLOAD[name] = int(value)
+
+    processes = []
+    with TemporaryDirectory() as home:
+        env = dict(environ)
+        try:
+            if (args.redis_server):
+                env["REDIS_PORT"] = str(free_port())
+                processes.append(subprocess.Popen([args.redis_server, "--port", env["REDIS_PORT"], "--save", "", "--appendonly", "no"], stdout=subprocess.DEVNULL))
+                wait_port(int(env["REDIS_PORT"]))
+            
+            lnbits_port = free_port()
+            lnmarkets_port = free_port()
+            feed_port = free_port()
+            processes.append(subprocess.Popen([sys.executable, path.join(ROOT, "benchmarks", "mocks.py"), 
+                "--lnbits-port", str(lnbits_port), 
+                "--lnmarkets-port", str(lnmarkets_port),
+                "--feed-port", str(feed_port),
+                "--latency", str(args.latency), 
+                "--error-rate", str(args.error_rate)
+            ]))
+            wait_port(lnbits_port)
+            wait_port(lnmarkets_port)
+            wait_port(feed_port)
+            
+            api_port = free_port()
+            env.update({
+                "HOME": home,
+                "API_PORT": str(api_port),
+                "API_JWT_SECRET": env.get("API_JWT_SECRET", token_hex(32)),
+                "LNM_KEY": "bench", 
+                "LNM_SECRET": "bench", 
+                "LNM_PASSPHRASE": "bench",
+                "LNM_URL": f"http://127.0.0.1:{lnmarkets_port}/v1",
+                "LNM_WS_URL": f"ws://127.0.0.1:{feed_port}",
+                "LNBITS_HOST": f"http://127.0.0.1:{lnbits_port}/api",
+                "LNBITS_WALLET_ADMIN_KEY": "bench", 
+                "LNBITS_WALLET_INVOICE_KEY": "bench",
+                "AUTH_BCRYPT_ROUNDS": env.get("AUTH_BCRYPT_ROUNDS", "4"),
+                # Every simulated user shares one IP, measure the API rather than the limiter.
+                "RATE_LIMIT_USER_RATE": env.get("RATE_LIMIT_USER_RATE", "0"),
+                "RATE_LIMIT_IP_RATE": env.get("RATE_LIMIT_IP_RATE", "0")
+            })
+            processes.append(subprocess.Popen([sys.executable, "-m", "uvicorn", "api:api", 
+                "--port", str(api_port), 
+                "--workers", str(args.workers), 
+                "--log-level", "warning"
+            ], cwd=ROOT, env=env))
+            wait_port(api_port)
+            
+            report = asyncio.run(run(args, api_port, lnbits_port))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                process.wait()
+    
+    print_report(report)
+    if (args.json):
+        with open(args.json, "w") as file:
+            file.write(dumps(report, indent=2))
+    
+    failed = False
+    for limit in filter(None, args.max_p99.split(",")):
+        name, value = limit.split("=")
+        if (report["endpoints"][name]["p99"] > float(value)):
+            print(f"{name} p99 {report['endpoints'][name]['p99']} ms exceeds {value} ms.")
+            failed = True
+    sys.exit(1 if (failed) else 0)
+
+if (__name__ == "__main__"):
+    main()
@@ -0,0 +1,368 @@
+"""Local stand-ins for the LNbits and LN Markets HTTP APIs used by the
+app, with configurable latency and error rate, and for the LN Markets
+websocket price feed.
+
+    python benchmarks/mocks.py --lnbits-port 5001 --lnmarkets-port 5002 --feed-port 5003 --latency 50 --error-rate 0.01
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import BaseRequestHandler, ThreadingTCPServer
+from urllib.parse import urlparse, parse_qs
+from threading import Thread, Lock
+from base64 import b64encode
+from hashlib import sha1, sha256
+from json import dumps, loads
+from time import sleep, time
+from os import urandom, path
+
+import argparse
+import hmac
+import random
+import select
+import struct
+import sys
+
+# Invoices are real BOLT11 payment requests, checked with the app's decoder.
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import bolt11
+
+# Key the LNbits stand-in signs its invoices with.
+INVOICE_KEY = bytes.fromhex("e126f68f7eafcc8b74f54d269fe206be715000f94dac067d1c04a8ca3b2db734")
+
+def sign(digest: bytes, private_key: bytes) -> bytes:
+    """Recoverable signature with a low S, the nonce is derived from the
+    key and the digest.
+    """
+    secret = int.from_bytes(private_key, "big")
+    e = int.from_bytes(digest, "big")
+    k = int.from_bytes(hmac.new(private_key, digest, sha256).digest(), "big") % (bolt11.N - 1) + 1
+    x, y = bolt11.to_affine(bolt11.multiply_generator(k))
+    r = x % bolt11.N
+    s = pow(k, -1, bolt11.N) * (e + r * secret) % bolt11.N
+    recovery = (y & 1) | (2 if (x >= bolt11.N) else 0)
+    if (s > bolt11.N // 2):
+        s = bolt11.N - s
+        recovery ^= 1
+    return r.to_bytes(32, "big") + s.to_bytes(32, "big") + bytes([recovery])
+
+def from_int(value: int, length: int = 0) -> list:
+    words = []
+    while (value) or (len(words) < length):
+        words.insert(0, value & 31)
+        value >>= 5
+    return words
+
+def encode_invoice(currency: str, amount_msat: int, date: int, tags: list, private_key: bytes) -> str:
+    """Build and sign a payment request from (tag, value) pairs. Amounts 
+    are written in the largest unit that keeps them whole.
+    """
+    hrp = f"ln{currency}"
+    if (amount_msat != None):
+        for multiplier, unit in sorted(bolt11.MULTIPLIERS.items(), key=lambda item: -item[1]):
+            if (amount_msat % unit == 0):
+                hrp += f"{amount_msat // unit}{multiplier}"
+                break
+        else:
+            hrp += f"{amount_msat * 10}p"
+
+    words = from_int(date, 7)
+    for tag, value in tags:
+        if (isinstance(value, int)):
+            field = from_int(value)
+        elif (isinstance(value, str)) and (tag in "pshn"):
+            field = bolt11.convert_bits(bytes.fromhex(value), 8, 5)
+        elif (isinstance(value, str)):
+            field = bolt11.convert_bits(value.encode(), 8, 5)
+        else:
+            field = bolt11.convert_bits(value, 8, 5)
+        words += [bolt11.CHARSET.index(tag)] + from_int(len(field), 2) + field
+    digest = sha256(hrp.encode() + bytes(bolt11.convert_bits(words, 5, 8))).digest()
+    return bolt11.bech32_encode(hrp, words + bolt11.convert_bits(sign(digest, private_key), 8, 5))
+
+class State:
+    """Wallets and invoices shared by both stand-ins."""
+
+    def __init__(self, lnbits_balance: int = 10 ** 11, lnmarkets_balance: int = 10 ** 8, price: float = 20000):
+        self.lock = Lock()
+        self.lnbits_balance = lnbits_balance
+        self.lnmarkets_balance = lnmarkets_balance
+        self.price = price
+        self.invoices = {}
+        self.payments = []
+        self.index = {}
+
+    def tick(self) -> float:
+        """Random walk of the index, a few basis points per tick."""
+        with self.lock:
+            self.price = round(self.price * (1 + random.gauss(0, 0.0003)), 2)
+            return self.price
+
+    def create_invoice(self, amount_msat: int, memo: str = "") -> dict:
+        payment_hash = urandom(32).hex()
+        invoice = {
+            "payment_hash": payment_hash,
+            "payment_request": encode_invoice("bcrt", amount_msat, int(time()), [("p", payment_hash), ("d", memo), ("x", 3600)], INVOICE_KEY),
+            "amount": amount_msat,
+            "memo": memo,
+            "paid": False,
+            "time": int(time())
+        }
+        with self.lock:
+            self.invoices[payment_hash] = invoice
+        return invoice
+
+    def decode(self, payment_request: str) -> dict:
+        invoice = bolt11.decode(payment_request)
+        return { "payment_hash": invoice["payment_hash"], "amount_msat": invoice["amount_msat"] }
+
+    def settle(self, payment_hash: str, amount_msat: int, outgoing: bool = False) -> dict:
+        payment = {
+            "checking_id": payment_hash,
+            "payment_hash": payment_hash,
+            "pending": False,
+            "amount": -amount_msat if (outgoing) else amount_msat,
+            "fee": -1000 if (outgoing) else 0,
+            "preimage": urandom(32).hex(),
+            "time": int(time())
+        }
+        with self.lock:
+            self.payments.append(payment)
+            self.index[payment_hash] = payment
+            if (payment_hash in self.invoices):
+                self.invoices[payment_hash]["paid"] = True
+        return payment
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state = None
+    latency = 0
+    error_rate = 0
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, data, status: int = 200):
+        body = dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return loads(self.rfile.read(length) or b"{}")
+
+    def delay(self):
+        if (self.latency):
+            sleep(random.expovariate(1 / self.latency))
+
+    def do_GET(self):
+        self.delay()
+        if (random.random() < self.error_rate):
+            return self.reply({ "detail": "Injected error." }, 500)
+        
+        url = urlparse(self.path)
+        self.route("GET", url.path, { key: value[0] for key, value in parse_qs(url.query).items() })
+
+    def do_POST(self):
+        self.delay()
+        if (random.random() < self.error_rate):
+            return self.reply({ "detail": "Injected error." }, 500)
+        
+        self.route("POST", urlparse(self.path).path, self.body())
+
+class LnbitsHandler(Handler):
+    def route(self, method: str, path: str, params: dict):
+        state = self.state
+        if (method == "GET") and (path == "/api/v1/wallet"):
+            return self.reply({ "id": "mock", "name": "mock", "balance": state.lnbits_balance })
+        
+        if (method == "GET") and (path == "/api/v1/payments"):
+            limit = int(params.get("limit", 10))
+            offset = int(params.get("offset", 0))
+            return self.reply(list(reversed(state.payments))[offset:offset + limit])
+        
+        if (method == "GET") and (path.startswith("/api/v1/payments/")):
+            payment = state.index.get(path.split("/")[-1])
+            if (payment == None):
+                return self.reply({ "paid": False, "preimage": None, "details": { "pending": True } })
+            return self.reply({ "paid": True, "preimage": payment["preimage"], "details": payment })
+        
+        if (method == "POST") and (path == "/api/v1/payments/decode"):
+            return self.reply(state.decode(params["data"]))
+        
+        if (method == "POST") and (path == "/api/v1/payments"):
+            if (params.get("out")):
+                invoice = state.decode(params["bolt11"])
+                with state.lock:
+                    state.lnbits_balance -= invoice["amount_msat"]
+                payment = state.settle(invoice["payment_hash"], invoice["amount_msat"], outgoing=True)
+                return self.reply({ "payment_hash": payment["payment_hash"], "checking_id": payment["checking_id"] })
+            
+            invoice = state.create_invoice(int(params["amount"]) * 1000, params.get("memo", ""))
+            return self.reply({ "payment_hash": invoice["payment_hash"], "payment_request": invoice["payment_request"], "checking_id": invoice["payment_hash"] })
+        
+        # Test hook, marks an invoice as paid like a payer would.
+        if (method == "POST") and (path.startswith("/mock/pay/")):
+            invoice = state.invoices[path.split("/")[-1]]
+            with state.lock:
+                state.lnbits_balance += invoice["amount"]
+            return self.reply(state.settle(invoice["payment_hash"], invoice["amount"]))
+        return self.reply({ "detail": "Not found." }, 404)
+
+class LNMarketsHandler(Handler):
+    def route(self, method: str, path: str, params: dict):
+        state = self.state
+        if (method == "GET") and (path == "/v1/user"):
+            return self.reply({ "balance": state.lnmarkets_balance, "synthetic_usd_balance": 0 })
+        
+        if (method == "GET") and (path == "/v1/futures/ticker"):
+            return self.reply({ "index": state.price, "bid": state.price - 0.5, "offer": state.price + 0.5 })
+        
+        if (method == "POST") and (path == "/v1/user/deposit"):
+            # Deposits credit the account as soon as the invoice is created.
+            invoice = state.create_invoice(int(params["amount"]) * 1000)
+            with state.lock:
+                state.lnmarkets_balance += int(params["amount"])
+            return self.reply({ "paymentRequest": invoice["payment_request"] })
+        
+        if (method == "POST") and (path == "/v1/user/withdraw"):
+            invoice = state.decode(params["invoice"])
+            with state.lock:
+                state.lnmarkets_balance -= invoice["amount_msat"] // 1000
+            return self.reply({ "id": urandom(16).hex(), "payment_hash": invoice["payment_hash"] })
+        
+        if (method == "POST") and (path == "/v1/swap"):
+            in_amount = params["in_amount"]
+            if (params["in_asset"] == "BTC"):
+                out_amount = round(in_amount * state.price / 10 ** 8, 2)
+            else:
+                out_amount = int(in_amount * 10 ** 8 / state.price)
+            return self.reply({ 
+                "in_asset": params["in_asset"], 
+                "out_asset": params["out_asset"], 
+                "in_amount": in_amount, 
+                "out_amount": out_amount, 
+                "exchange_rate": state.price 
+            })
+        return self.reply({ "detail": "Not found." }, 404)
+
+class FeedHandler(BaseRequestHandler):
+    """Minimal websocket server speaking the LN Markets JSON-RPC
+    subscription protocol, pushing the index every `interval` seconds.
+    """
+    state = None
+    interval = 1
+
+    def read_frame(self) -> tuple:
+        head = self.request.recv(2, 0x100)
+        if (len(head) < 2):
+            return (0x8, b"")
+        
+        opcode, length = head[0] & 0x0f, head[1] & 0x7f
+        if (length == 126):
+            length = struct.unpack("!H", self.request.recv(2, 0x100))[0]
+        elif (length == 127):
+            length = struct.unpack("!Q", self.request.recv(8, 0x100))[0]
+        
+        mask = self.request.recv(4, 0x100) if (head[1] & 0x80) else b"\x00" * 4
+        payload = self.request.recv(length, 0x100) if (length) else b""
+        return (opcode, bytes([byte ^ mask[i % 4] for i, byte in enumerate(payload)]))
+
+    def send_frame(self, payload: bytes, opcode: int = 0x1):
+        if (len(payload) < 126):
+            head = struct.pack("!BB", 0x80 | opcode, len(payload))
+        elif (len(payload) < 65536):
+            head = struct.pack("!BBH", 0x80 | opcode, 126, len(payload))
+        else:
+            head = struct.pack("!BBQ", 0x80 | opcode, 127, len(payload))
+        self.request.sendall(head + payload)
+
+    def handshake(self) -> bool:
+        request = b""
+        while not (b"\r\n\r\n" in request):
+            chunk = self.request.recv(1024)
+            if not (chunk):
+                return False
+            request += chunk
+        
+        headers = dict([line.split(": ", 1) for line in request.decode().split("\r\n")[1:] if (": " in line)])
+        key = headers.get("Sec-WebSocket-Key", headers.get("sec-websocket-key", ""))
+        accept = b64encode(sha1((key + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        self.request.sendall((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        return True
+
+    def handle(self):
+        if not (self.handshake()):
+            return
+        
+        channels = []
+        deadline = time()
+        while True:
+            readable, _, _ = select.select([self.request], [], [], max(deadline - time(), 0))
+            if (readable):
+                opcode, payload = self.read_frame()
+                if (opcode == 0x8):
+                    return
+                
+                if (opcode == 0x9):
+                    self.send_frame(payload, 0xA)
+                elif (opcode == 0x1):
+                    message = loads(payload)
+                    if (message.get("method") == "v1/public/subscribe"):
+                        channels = message["params"]
+                        self.send_frame(dumps({ "jsonrpc": "2.0", "id": message["id"], "result": True }).encode())
+                continue
+            
+            deadline = time() + self.interval
+            price = self.state.tick()
+            for channel in channels:
+                data = { "index": price } if (channel.endswith(":index")) else { "lastPrice": price }
+                data["time"] = int(time() * 1000)
+                self.send_frame(dumps({ "jsonrpc": "2.0", "method": "subscription", "params": { "channel": channel, "data": data } }).encode())
+
+def serve_feed(port: int, state: State, interval: float = 1000) -> ThreadingTCPServer:
+    """Start the price feed stand-in on a background thread, `interval`
+    is in milliseconds.
+    """
+    handler = type("FeedHandler", (FeedHandler,), { "state": state, "interval": interval / 1000 })
+    ThreadingTCPServer.allow_reuse_address = True
+    server = ThreadingTCPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def serve(handler, port: int, state: State, latency: float = 0, error_rate: float = 0) -> ThreadingHTTPServer:
+    """Start a stand-in on a background thread. Latency is the mean in
+    milliseconds of an exponential distribution.
+    """
+    handler = type(handler.__name__, (handler,), { "state": state, "latency": latency / 1000, "error_rate": error_rate })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--lnbits-port", type=int, default=5001)
+    parser.add_argument("--lnmarkets-port", type=int, default=5002)
+    parser.add_argument("--feed-port", type=int, default=5003)
+    parser.add_argument("--tick", type=float, default=1000, help="milliseconds between price updates")
+    parser.add_argument("--latency", type=float, default=0, help="mean upstream latency in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with a 500")
+    args = parser.parse_args()
+
+    state = State()
+    serve(LnbitsHandler, args.lnbits_port, state, args.latency, args.error_rate)
+    serve(LNMarketsHandler, args.lnmarkets_port, state, args.latency, args.error_rate)
+    serve_feed(args.feed_port, state, args.tick)
+    while True:
+        sleep(3600)
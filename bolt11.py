@@ -0,0 +1,314 @@
+from hashlib import sha256
+from re import match
+from threading import Lock
+from time import time
+
+CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+# Millisatoshis per unit of each amount multiplier, a bare amount is in BTC.
+MULTIPLIERS = { "m": 10 ** 8, "u": 10 ** 5, "n": 10 ** 2, "": 10 ** 11 }
+
+# Signature (64 bytes and the recovery id) at the end of the data part.
+SIGNATURE_WORDS = 104
+
+DEFAULT_EXPIRY = 3600
+DEFAULT_MIN_FINAL_CLTV_EXPIRY = 18
+
+# secp256k1 field prime, group order and generator.
+P = 2 ** 256 - 2 ** 32 - 977
+N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
+G = (
+    0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798, 
+    0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+)
+
+# Endomorphism (x, y) -> (BETA * x, y) equal to multiplying by LAMBDA,
+# with the basis splitting a scalar into two halves of ~128 bits.
+BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+A1, B1 = 0x3086d221a7d46bcde86c90e49284eb15, -0xe4437ed6010e88286f547fa90abfe4c3
+A2, B2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8, 0x3086d221a7d46bcde86c90e49284eb15
+
+class InvoiceError(Exception):
+    pass
+
+# Points are kept in Jacobian coordinates (X, Y, Z), Z = 0 is infinity.
+INFINITY = (0, 1, 0)
+
+def point_double(point: tuple) -> tuple:
+    x, y, z = point
+    if (z == 0) or (y == 0):
+        return INFINITY
+    
+    yy = y * y % P
+    s = 4 * x * yy % P
+    m = 3 * x * x % P
+    nx = (m * m - 2 * s) % P
+    return (nx, (m * (s - nx) - 8 * yy * yy) % P, 2 * y * z % P)
+
+def point_add(first: tuple, second: tuple) -> tuple:
+    x1, y1, z1 = first
+    x2, y2, z2 = second
+    if (z1 == 0):
+        return second
+    
+    if (z2 == 0):
+        return first
+    
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    if (z2 == 1):
+        # Affine second point, the common case of the tables.
+        u1, s1 = x1, y1
+    else:
+        z2z2 = z2 * z2 % P
+        u1 = x1 * z2z2 % P
+        s1 = y1 * z2 * z2z2 % P
+    if (u1 == u2):
+        return point_double(first) if (s1 == s2) else INFINITY
+    
+    h = (u2 - u1) % P
+    hh = h * h % P
+    hhh = h * hh % P
+    r = (s2 - s1) % P
+    v = u1 * hh % P
+    nx = (r * r - hhh - 2 * v) % P
+    return (nx, (r * (v - nx) - s1 * hhh) % P, h * z1 * z2 % P)
+
+def to_affine(point: tuple) -> tuple:
+    x, y, z = point
+    inverse = pow(z, -1, P)
+    return (x * inverse * inverse % P, y * inverse * inverse * inverse % P)
+
+def split(scalar: int) -> tuple:
+    """Halves k1, k2 with k1 + k2 * LAMBDA = scalar (mod N)."""
+    c1 = (B2 * scalar + N // 2) // N
+    c2 = (-B1 * scalar + N // 2) // N
+    return (scalar - c1 * A1 - c2 * A2, -c1 * B1 - c2 * B2)
+
+def multiply(scalar: int, point: tuple) -> tuple:
+    """`scalar` times an affine point, four bits of both halves of the
+    scalar at a time so they share their doublings.
+    """
+    window = [INFINITY, (point[0], point[1], 1)]
+    for _ in range(14):
+        window.append(point_add(window[-1], window[1]))
+    window = [INFINITY] + [to_affine(point) + (1,) for point in window[1:]]
+    
+    k1, k2 = split(scalar)
+    first = [(x, y if (k1 >= 0) else P - y, z) for x, y, z in window]
+    second = [(BETA * x % P, y if (k2 >= 0) else P - y, z) for x, y, z in window]
+    k1, k2 = abs(k1), abs(k2)
+    
+    result = INFINITY
+    for shift in range(max(k1.bit_length(), k2.bit_length()) // 4 * 4, -1, -4):
+        for _ in range(4):
+            result = point_double(result)
+        result = point_add(result, first[(k1 >> shift) & 15])
+        result = point_add(result, second[(k2 >> shift) & 15])
+    return result
+
+# Multiples j * 16^i * G of the generator, built on first use. Decodes
+# run in worker threads, so it is built once under a lock.
+table = []
+table_lock = Lock()
+
+def build_table():
+    with table_lock:
+        if (table):
+            return
+        
+        rows = []
+        base = (G[0], G[1], 1)
+        for _ in range(64):
+            row = [INFINITY, base]
+            for _ in range(14):
+                row.append(point_add(row[-1], base))
+            rows.append([to_affine(point) + (1,) if (point[2]) else point for point in row])
+            base = point_double(row[8])
+        table.extend(rows)
+
+def multiply_generator(scalar: int) -> tuple:
+    """`scalar` times the generator, one table addition per four bits."""
+    if not (table):
+        build_table()
+    
+    result = INFINITY
+    for i in range(64):
+        result = point_add(result, table[i][(scalar >> (4 * i)) & 15])
+    return result
+
+def recover(digest: bytes, signature: bytes) -> bytes:
+    """Compressed public key that produced the recoverable `signature`
+    over `digest`.
+    """
+    r = int.from_bytes(signature[:32], "big")
+    s = int.from_bytes(signature[32:64], "big")
+    recovery = signature[64]
+    if not (0 < r < N) or not (0 < s < N) or (recovery > 3):
+        raise InvoiceError("Invoice signature is invalid.")
+    
+    x = r + N if (recovery & 2) else r
+    alpha = (pow(x, 3, P) + 7) % P
+    beta = pow(alpha, (P + 1) // 4, P)
+    if (x >= P) or (beta * beta % P != alpha):
+        raise InvoiceError("Invoice signature is invalid.")
+    
+    y = beta if ((beta & 1) == (recovery & 1)) else P - beta
+    inverse = pow(r, -1, N)
+    e = int.from_bytes(digest, "big")
+    point = point_add(multiply_generator((-e * inverse) % N), multiply((s * inverse) % N, (x, y)))
+    if (point[2] == 0):
+        raise InvoiceError("Invoice signature is invalid.")
+    
+    x, y = to_affine(point)
+    return bytes([2 + (y & 1)]) + x.to_bytes(32, "big")
+
+def polymod(values: list) -> int:
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            checksum ^= generator[i] if ((top >> i) & 1) else 0
+    return checksum
+
+def expand(hrp: str) -> list:
+    return [ord(char) >> 5 for char in hrp] + [0] + [ord(char) & 31 for char in hrp]
+
+def checksum(hrp: str, words: list) -> list:
+    values = polymod(expand(hrp) + words + [0] * 6) ^ 1
+    return [(values >> 5 * (5 - i)) & 31 for i in range(6)]
+
+def bech32_decode(string: str) -> tuple:
+    """Split a bech32 string into its human readable part and 5 bit words,
+    without the length limit which invoices exceed.
+    """
+    if (string.lower() != string) and (string.upper() != string):
+        raise InvoiceError("Invoice mixes upper and lower case.")
+
+    string = string.lower()
+    position = string.rfind("1")
+    if (position < 1) or (position + 7 > len(string)):
+        raise InvoiceError("Invoice is not bech32.")
+
+    hrp = string[:position]
+    try:
+        words = [CHARSET.index(char) for char in string[position + 1:]]
+    except ValueError:
+        raise InvoiceError("Invoice has an invalid character.")
+
+    if (polymod(expand(hrp) + words) != 1):
+        raise InvoiceError("Invoice checksum is invalid.")
+    return (hrp, words[:-6])
+
+def bech32_encode(hrp: str, words: list) -> str:
+    return hrp + "1" + "".join([CHARSET[word] for word in words + checksum(hrp, words)])
+
+def convert_bits(data: list, source: int, target: int, pad: bool = True) -> list:
+    accumulator = 0
+    bits = 0
+    result = []
+    for value in data:
+        accumulator = (accumulator << source) | value
+        bits += source
+        while (bits >= target):
+            bits -= target
+            result.append((accumulator >> bits) & ((1 << target) - 1))
+
+    if (pad) and (bits):
+        result.append((accumulator << (target - bits)) & ((1 << target) - 1))
+    return result
+
+def to_int(words: list) -> int:
+    value = 0
+    for word in words:
+        value = value * 32 + word
+    return value
+
+def to_bytes(words: list) -> bytes:
+    return bytes(convert_bits(words, 5, 8, False))
+
+def parse_amount(hrp: str) -> tuple:
+    """Currency prefix and amount in millisatoshis (None when the invoice
+    leaves it to the payer) of the human readable part.
+    """
+    parts = match(r"^ln([a-z]+?)(?:(\d+)([munp]?))?$", hrp)
+    if (parts == None):
+        raise InvoiceError("Invoice prefix is invalid.")
+
+    currency, amount, multiplier = parts.groups()
+    if (amount == None):
+        return (currency, None)
+
+    if (multiplier == "p"):
+        if (int(amount) % 10):
+            raise InvoiceError("Invoice amount is below a millisatoshi.")
+        return (currency, int(amount) // 10)
+    return (currency, int(amount) * MULTIPLIERS[multiplier])
+
+def decode(payment_request: str) -> dict:
+    """Decode a BOLT11 payment request locally and check its signature.
+    Fields LNbits returns from its decode endpoint keep the same names.
+    """
+    hrp, words = bech32_decode(payment_request.strip())
+    if (len(words) < 7 + SIGNATURE_WORDS):
+        raise InvoiceError("Invoice is too short.")
+
+    currency, amount_msat = parse_amount(hrp)
+    data = words[:-SIGNATURE_WORDS]
+    invoice = {
+        "currency": currency,
+        "amount_msat": amount_msat,
+        "date": to_int(data[:7]),
+        "payment_hash": None,
+        "payment_secret": None,
+        "description": None,
+        "description_hash": None,
+        "payee": None,
+        "expiry": DEFAULT_EXPIRY,
+        "min_final_cltv_expiry": DEFAULT_MIN_FINAL_CLTV_EXPIRY,
+    }
+
+    position = 7
+    while (position + 3 <= len(data)):
+        tag = CHARSET[data[position]]
+        length = to_int(data[position + 1:position + 3])
+        field = data[position + 3:position + 3 + length]
+        position += 3 + length
+        if (len(field) != length):
+            raise InvoiceError("Invoice field is truncated.")
+
+        # Fields of an unexpected length are skipped, as the spec requires.
+        if (tag == "p") and (length == 52):
+            invoice["payment_hash"] = to_bytes(field).hex()
+        elif (tag == "s") and (length == 52):
+            invoice["payment_secret"] = to_bytes(field).hex()
+        elif (tag == "h") and (length == 52):
+            invoice["description_hash"] = to_bytes(field).hex()
+        elif (tag == "n") and (length == 53):
+            invoice["payee"] = to_bytes(field).hex()
+        elif (tag == "d"):
+            invoice["description"] = to_bytes(field).decode("utf-8", "replace")
+        elif (tag == "x"):
+            invoice["expiry"] = to_int(field)
+        elif (tag == "c"):
+            invoice["min_final_cltv_expiry"] = to_int(field)
+
+    if (invoice["payment_hash"] == None):
+        raise InvoiceError("Invoice has no payment hash.")
+    
+    # The payee is recovered from the signature, it must match an explicit one.
+    digest = sha256(hrp.encode() + bytes(convert_bits(data, 5, 8))).digest()
+    payee = recover(digest, to_bytes(words[-SIGNATURE_WORDS:])).hex()
+    if (invoice["payee"] != None) and (invoice["payee"] != payee):
+        raise InvoiceError("Invoice signature does not match the payee.")
+    
+    invoice["payee"] = payee
+    return invoice
+
+def check_expiry(invoice: dict, now: float = None):
+    if ((now or time()) > invoice["date"] + invoice["expiry"]):
+        raise InvoiceError("Invoice has expired.")
@@ -1,8 +1,53 @@
 from datetime import datetime
-from configs import PATH
-from peewee import SqliteDatabase, Model, DateTimeField, TextField, FloatField
+from functools import partial
+from configs import DATABASE_URL, DATABASE_THREADS
+from anyio import CapacityLimiter, to_thread
+from playhouse.shortcuts import model_to_dict
+from playhouse import db_url
+from peewee import Model, DateTimeField, TextField, BigIntegerField, SqliteDatabase, IntegrityError, fn
+from time import perf_counter
+from json import dumps, loads
+from os import makedirs, path
 
-database = SqliteDatabase(f"{PATH}/data/database.db")
+import telemetry
+
+# SQLite runs in WAL mode so readers are not blocked by the writer.
+SQLITE_PRAGMAS = [
+    ("journal_mode", "wal"),
+    ("synchronous", "normal"),
+    ("cache_size", -64000),
+    ("busy_timeout", 5000),
+    ("temp_store", "memory")
+]
+
+def connect(url: str):
+    if (url.startswith("sqlite")):
+        # Pooled connections are handed to whichever worker thread checks them out.
+        return db_url.connect(url, pragmas=SQLITE_PRAGMAS, check_same_thread=False)
+    return db_url.connect(url)
+
+database = connect(DATABASE_URL)
+atomic = database.atomic
+connection = database.connection_context
+
+# Every statement is recorded as a `sql.<VERB>` stage.
+execute_sql = database.execute_sql
+
+def timed_execute_sql(sql: str, *args, **kwargs):
+    with telemetry.span(f"sql.{sql.split(' ', 1)[0].upper()}"):
+        return execute_sql(sql, *args, **kwargs)
+
+database.execute_sql = timed_execute_sql
+
+# Balances and amounts are stored as integers in the smallest unit
+# of each currency, msats for BTC and cents for USD.
+UNITS = { "BTC": 1000, "USD": 100 }
+
+def to_units(currency: str, value: float) -> int:
+    return int(round(value * UNITS[currency]))
+
+def from_units(currency: str, units: int) -> float:
+    return (units / UNITS[currency])
 
 class BaseModel(Model):
     class Meta:
@@ -15,21 +60,358 @@ class User(BaseModel):
 class Balance(BaseModel):
     username   = TextField()
     currency   = TextField(choices=["BTC", "USD"])
-    balance    = FloatField(default=0)
+    balance    = BigIntegerField(default=0)
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
 
+    class Meta:
+        indexes = (
+            (("username", "currency"), True),
+        )
+
 class Transaction(BaseModel):
     txid         = TextField()
     username     = TextField()
     destination  = TextField()
     currency     = TextField(choices=["BTC", "USD"])
-    value        = FloatField(default=0)
-    fee          = FloatField(default=0)
+    value        = BigIntegerField(default=0)
+    fee          = BigIntegerField(default=0)
     status       = TextField(choices=["settled", "pending", "canceled"])
     typeof       = TextField(column_name="type", choices=["withdraw", "deposit"])
     description  = TextField(null=True)
     created_at   = DateTimeField(default=datetime.now)
     updated_at   = DateTimeField(default=datetime.now)
 
-database.create_tables([User, Balance, Transaction])
\ No newline at end of file
+    class Meta:
+        indexes = (
+            (("username", "created_at"), False),
+            (("username", "txid"), False),
+            (("status", "typeof"), False),
+            (("txid", "typeof"), True),
+        )
+
+    def to_dict(self) -> dict:
+        tx = model_to_dict(self)
+        tx["value"] = from_units(self.currency, self.value)
+        tx["fee"] = from_units(self.currency, self.fee)
+        tx["type"] = tx.pop("typeof")
+        del tx["id"]
+        return tx
+
+def transactions_page(username: str, since: datetime = None, until: datetime = None, after: tuple = None, limit: int = 500) -> list:
+    """Next page of the transactions of `username` after the (created_at, id)
+    position `after`, as plain rows streamed from the cursor.
+    """
+    query = Transaction.select().where(Transaction.username == username)
+    if (since):
+        query = query.where(Transaction.created_at >= since)
+    
+    if (until):
+        query = query.where(Transaction.created_at < until)
+    
+    if (after):
+        created_at, id = after
+        query = query.where(
+            (Transaction.created_at > created_at) | 
+            ((Transaction.created_at == created_at) & (Transaction.id > id))
+        )
+    return list(query.order_by(Transaction.created_at, Transaction.id).limit(limit).dicts().iterator())
+
+class Job(BaseModel):
+    """Journal of a swap or withdrawal, every step is recorded before the
+    upstream call it leads to so an interrupted job can be recovered.
+    """
+    jobid      = TextField(unique=True)
+    username   = TextField()
+    typeof     = TextField(column_name="type", choices=["swap", "withdraw"])
+    step       = TextField()
+    status     = TextField(choices=["running", "settled", "failed", "review"])
+    params     = TextField()
+    result     = TextField(null=True)
+    error      = TextField(null=True)
+    created_at = DateTimeField(default=datetime.now)
+    updated_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = (
+            (("status", "updated_at"), False),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.jobid,
+            "username": self.username,
+            "type": self.typeof,
+            "step": self.step,
+            "status": self.status,
+            "params": loads(self.params),
+            "result": loads(self.result) if (self.result) else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at
+        }
+
+class StaleJob(Exception):
+    """The job was moved on by someone else, e.g. the recovery worker."""
+
+def encode_result(value) -> str:
+    return dumps(value, default=lambda value: value.isoformat())
+
+def open_job(jobid: str, username: str, typeof: str, step: str, params: dict, currency: str, amount: int) -> bool:
+    """Debit `amount` and journal the job in the same transaction. Returns
+    False, without a job, when the balance does not cover it.
+    """
+    with atomic():
+        if (debit(username, currency, amount) == False):
+            return False
+        
+        Job.create(jobid=jobid, username=username, typeof=typeof, step=step, status="running", params=dumps(params))
+    return True
+
+def advance_job(jobid: str, step: str, next_step: str, params: dict, refund: tuple = None) -> bool:
+    """Move a running job from `step` to `next_step`, optionally crediting
+    a (username, currency, amount) refund in the same transaction.
+    """
+    with atomic():
+        updated = Job.update(step=next_step, params=dumps(params), updated_at=datetime.now()).where(
+            (Job.jobid == jobid) & 
+            (Job.step == step) & 
+            (Job.status == "running")
+        ).execute()
+        if (updated == 1) and (refund != None):
+            credit(*refund)
+    return (updated == 1)
+
+def advance_jobs(jobids: list, step: str, next_step: str):
+    with atomic():
+        Job.update(step=next_step, updated_at=datetime.now()).where(
+            (Job.jobid.in_(jobids)) & 
+            (Job.step == step) & 
+            (Job.status == "running")
+        ).execute()
+
+def finish_job(jobid: str, steps: list, status: str, result=None, error: str = None) -> bool:
+    """Close a job still running at one of `steps`, call it inside the
+    transaction applying its outcome.
+    """
+    updated = Job.update(status=status, result=encode_result(result) if (result != None) else None, error=error, updated_at=datetime.now()).where(
+        (Job.jobid == jobid) & 
+        (Job.step.in_(steps)) & 
+        (Job.status == "running")
+    ).execute()
+    return (updated == 1)
+
+def compensate_job(jobid: str, steps: list, username: str, currency: str, amount: int, error: str) -> bool:
+    """Fail a job and return the `amount` it debited."""
+    with atomic():
+        if (finish_job(jobid, steps, "failed", error=error) == False):
+            return False
+        
+        credit(username, currency, amount)
+    return True
+
+def get_job(jobid: str) -> dict:
+    job = Job.get_or_none(Job.jobid == jobid)
+    return job.to_dict() if (job) else None
+
+def stale_jobs(before: datetime) -> list:
+    """Running jobs not journaled since `before`."""
+    return [job.to_dict() for job in Job.select().where((Job.status == "running") & (Job.updated_at < before))]
+
+class Migration(BaseModel):
+    name       = TextField(unique=True)
+    created_at = DateTimeField(default=datetime.now)
+
+def credit(username: str, currency: str, amount: int):
+    """Add `amount` units to the balance in a single upsert statement,
+    creating the balance if needed. A negative amount is applied as an
+    adjustment.
+    """
+    with atomic():
+        Balance.insert(username=username, currency=currency, balance=amount).on_conflict(
+            conflict_target=[Balance.username, Balance.currency],
+            update={ Balance.balance: Balance.balance + amount, Balance.updated_at: datetime.now() }
+        ).execute()
+
+def debit(username: str, currency: str, amount: int) -> bool:
+    """Remove `amount` units from the balance in a single conditional
+    statement. Returns False when the balance does not cover it.
+    """
+    with atomic():
+        updated = Balance.update(balance=Balance.balance - amount, updated_at=datetime.now()).where(
+            (Balance.username == username) & 
+            (Balance.currency == currency) &
+            (Balance.balance >= amount)
+        ).execute()
+    return (updated == 1)
+
+def pending_deposits(payment_hashes: list = None) -> dict:
+    """Pending deposits by payment hash, as (username, created_at) tuples."""
+    query = Transaction.select(Transaction.txid, Transaction.username, Transaction.created_at).where(
+        (Transaction.status == "pending") & 
+        (Transaction.typeof == "deposit")
+    )
+    if (payment_hashes != None):
+        query = query.where(Transaction.txid.in_(payment_hashes))
+    return { tx.txid: (tx.username, int(tx.created_at.timestamp())) for tx in query }
+
+def settle_deposits(deposits: list) -> list:
+    """Credit a batch of (username, payment_hash, amount_msat) deposits in
+    one transaction. Each deposit moves from pending to settled with a
+    conditional update, so payment hashes already credited are skipped.
+    The settled ones are returned.
+    """
+    settled = []
+    with atomic():
+        for username, payment_hash, amount_msat in deposits:
+            updated = Transaction.update(status="settled", value=amount_msat, updated_at=datetime.now()).where(
+                (Transaction.txid == payment_hash) & 
+                (Transaction.typeof == "deposit") & 
+                (Transaction.status == "pending")
+            ).execute()
+            if (updated == 0):
+                # A deposit already recorded, e.g. by a worker settling it at
+                # the same time, is rejected by the unique (txid, type) index.
+                # Only the insert is rolled back, to its savepoint.
+                try:
+                    with atomic():
+                        Transaction.create(
+                            txid=payment_hash,
+                            username=username,
+                            destination=username, 
+                            currency="BTC",
+                            value=amount_msat,
+                            status="settled",
+                            typeof="deposit"
+                        )
+                except IntegrityError:
+                    continue
+            
+            credit(username, "BTC", amount_msat)
+            settled.append(payment_hash)
+    return settled
+
+def cancel_deposits(payment_hashes: list) -> list:
+    """Move expired pending deposits to canceled."""
+    with atomic():
+        Transaction.update(status="canceled", updated_at=datetime.now()).where(
+            (Transaction.txid.in_(payment_hashes)) & 
+            (Transaction.typeof == "deposit") & 
+            (Transaction.status == "pending")
+        ).execute()
+    return payment_hashes
+
+def migrate_integer_units():
+    for currency, units in UNITS.items():
+        Balance.update(balance=fn.ROUND(Balance.balance * units).cast("INTEGER")).where(Balance.currency == currency).execute()
+        Transaction.update(
+            value=fn.ROUND(Transaction.value * units).cast("INTEGER"), 
+            fee=fn.ROUND(Transaction.fee * units).cast("INTEGER")
+        ).where(Transaction.currency == currency).execute()
+
+def migrate_merge_balances():
+    # Required before the unique (username, currency) index is created.
+    duplicates = Balance.select(
+        Balance.username, 
+        Balance.currency, 
+        fn.MIN(Balance.id).alias("keep"), 
+        fn.SUM(Balance.balance).alias("total")
+    ).group_by(Balance.username, Balance.currency).having(fn.COUNT(Balance.id) > 1)
+    for duplicate in duplicates:
+        Balance.update(balance=duplicate.total).where(Balance.id == duplicate.keep).execute()
+        Balance.delete().where(
+            (Balance.username == duplicate.username) & 
+            (Balance.currency == duplicate.currency) & 
+            (Balance.id != duplicate.keep)
+        ).execute()
+
+def migrate_unique_transactions():
+    # Required before the unique (txid, type) index is created. Duplicates
+    # are kept for the record, under the txid suffixed with their id.
+    duplicates = list(Transaction.select(
+        Transaction.txid, 
+        Transaction.typeof, 
+        fn.MIN(Transaction.id).alias("keep")
+    ).group_by(Transaction.txid, Transaction.typeof).having(fn.COUNT(Transaction.id) > 1))
+    for duplicate in duplicates:
+        for tx in list(Transaction.select(Transaction.id).where(
+            (Transaction.txid == duplicate.txid) & 
+            (Transaction.typeof == duplicate.typeof) & 
+            (Transaction.id != duplicate.keep)
+        )):
+            Transaction.update(txid=f"{duplicate.txid}.{tx.id}").where(Transaction.id == tx.id).execute()
+
+MIGRATIONS = [
+    ("integer_units", migrate_integer_units),
+    ("merge_balances", migrate_merge_balances),
+    ("unique_transactions", migrate_unique_transactions)
+]
+
+def exclusive():
+    """Transaction taking the write lock up front on SQLite, so workers 
+    starting together apply each migration only once.
+    """
+    if (isinstance(database, SqliteDatabase)):
+        return database.atomic("IMMEDIATE")
+    return database.atomic()
+
+def migrate():
+    """Apply the data migrations that have not been applied yet."""
+    for name, migration in MIGRATIONS:
+        try:
+            with exclusive():
+                if (Migration.select().where(Migration.name == name).exists() == False):
+                    migration()
+                    Migration.create(name=name)
+        except IntegrityError:
+            # Applied concurrently by another worker, rolled back here.
+            pass
+
+MODELS = [User, Balance, Transaction, Job, Migration]
+
+def prepare():
+    """Create the SQLite data directory, before any connection is opened."""
+    if (DATABASE_URL.startswith("sqlite")) and (database.database != ":memory:"):
+        makedirs(path.dirname(path.abspath(database.database)), exist_ok=True)
+
+def setup():
+    """Create the tables, apply the migrations and create the indexes. 
+    Runs once on startup rather than on import.
+    """
+    # Indexes are created after the migrations, which may have to clean
+    # up rows that would violate them.
+    for model in MODELS:
+        model._schema.create_table(safe=True)
+
+    migrate()
+
+    for model in MODELS:
+        model._schema.create_indexes(safe=True)
+
+def ping():
+    database.execute_sql("SELECT 1")
+
+limiter = None
+
+def scoped(function, submitted: float, *args):
+    telemetry.waits.observe(perf_counter() - submitted, "database")
+    with connection():
+        return function(*args)
+
+def stage_name(function) -> str:
+    if (isinstance(function, partial)):
+        function = function.func
+    return getattr(function, "__name__", "query")
+
+async def run(function, *args):
+    """Run blocking database work in the bounded database thread pool,
+    holding a (pooled) connection only for the duration of the work.
+    """
+    global limiter
+    if (limiter == None):
+        limiter = CapacityLimiter(DATABASE_THREADS)
+    
+    with telemetry.span(f"db.{stage_name(function)}"):
+        return await to_thread.run_sync(partial(scoped, function, perf_counter(), *args), limiter=limiter)
+
+telemetry.pool("database", lambda: telemetry.limiter_usage(limiter) if (limiter) else (0, DATABASE_THREADS, 0))
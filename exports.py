@@ -0,0 +1,119 @@
+"""Stream the transaction history of a user as NDJSON or CSV, in pages of
+`EXPORT_PAGE_SIZE` rows so memory stays constant. Every row carries the
+cursor to resume the export right after it.
+
+    python exports.py username --format csv --since 2023-01-01 > history.csv
+"""
+
+from dotenv import load_dotenv
+from os import environ
+
+if (__name__ == "__main__"):
+    # Loads the variables of environments in the .env file
+    # of the current directory.
+    load_dotenv(environ.get("ENV_PATH", ".env"))
+
+from configs import EXPORT_PAGE_SIZE
+from helpers import encode_cursor, decode_cursor
+from datetime import datetime
+from json import dumps
+from io import StringIO
+
+import database
+import argparse
+import sys
+import csv
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+FIELDS = ["txid", "username", "destination", "currency", "value", "fee", "status", "type", "description", "created_at", "updated_at", "cursor"]
+
+def to_row(tx: dict) -> dict:
+    return {
+        "txid": tx["txid"],
+        "username": tx["username"],
+        "destination": tx["destination"],
+        "currency": tx["currency"],
+        "value": database.from_units(tx["currency"], tx["value"]),
+        "fee": database.from_units(tx["currency"], tx["fee"]),
+        "status": tx["status"],
+        "type": tx["typeof"],
+        "description": tx["description"],
+        "created_at": tx["created_at"].isoformat(),
+        "updated_at": tx["updated_at"].isoformat(),
+        "cursor": encode_cursor(tx["created_at"], tx["id"])
+    }
+
+def render(page: list, format: str, header: bool = False) -> str:
+    if (format == "ndjson"):
+        return "".join([dumps(to_row(tx)) + "\n" for tx in page])
+    
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=FIELDS)
+    if (header):
+        writer.writeheader()
+    
+    for tx in page:
+        writer.writerow(to_row(tx))
+    return output.getvalue()
+
+def next_position(page: list) -> tuple:
+    return (page[-1]["created_at"], page[-1]["id"])
+
+async def stream(username: str, format: str = "ndjson", since: datetime = None, until: datetime = None, cursor: str = None):
+    """Yield the export page by page, each page fetched on its own pooled
+    connection in the database thread pool.
+    """
+    after = decode_cursor(cursor) if (cursor) else None
+    header = (after == None)
+    while True:
+        page = await database.run(database.transactions_page, username, since, until, after, EXPORT_PAGE_SIZE)
+        if (page) or (header):
+            yield render(page, format, header)
+        
+        if (len(page) < EXPORT_PAGE_SIZE):
+            break
+        
+        header = False
+        after = next_position(page)
+
+def export(file, username: str, format: str = "ndjson", since: datetime = None, until: datetime = None, cursor: str = None) -> int:
+    """Blocking counterpart of `stream` writing to `file`, returns the
+    number of transactions written.
+    """
+    after = decode_cursor(cursor) if (cursor) else None
+    header = (after == None)
+    count = 0
+    while True:
+        with database.connection():
+            page = database.transactions_page(username, since, until, after, EXPORT_PAGE_SIZE)
+        
+        if (page) or (header):
+            file.write(render(page, format, header))
+        
+        count += len(page)
+        if (len(page) < EXPORT_PAGE_SIZE):
+            return count
+        
+        header = False
+        after = next_position(page)
+
+if (__name__ == "__main__"):
+    parser = argparse.ArgumentParser(description="Export the transaction history of a user.")
+    parser.add_argument("username")
+    parser.add_argument("--format", choices=list(FORMATS.keys()), default="ndjson")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="ISO date or datetime, inclusive")
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None, help="ISO date or datetime, exclusive")
+    parser.add_argument("--cursor", default=None, help="resume right after the row carrying this cursor")
+    parser.add_argument("--output", default="-", help="file to write (appended when resuming), - for stdout")
+    args = parser.parse_args()
+
+    if (args.output == "-"):
+        count = export(sys.stdout, args.username, args.format, args.since, args.until, args.cursor)
+    else:
+        with open(args.output, "a" if (args.cursor) else "w", newline="") as file:
+            count = export(file, args.username, args.format, args.since, args.until, args.cursor)
+    print(f"Exported {count} transactions.", file=sys.stderr)
@@ -0,0 +1,50 @@
+from services.lnmarkets import alnmarkets
+from services.lnbits import alnbits
+from services.redis import aredis
+from configs import HEALTH_CHECK_TIMEOUT
+from time import perf_counter
+from json import loads
+
+import database
+import asyncio
+
+async def check_redis():
+    await aredis.ping()
+
+async def check_database():
+    await database.run(database.ping)
+
+async def check_lnbits():
+    wallet = await alnbits.get_wallet()
+    if (wallet.get("detail")):
+        raise Exception(wallet["detail"])
+
+async def check_lnmarkets():
+    user = loads(await alnmarkets.get_user())
+    if not ("balance" in user):
+        raise Exception(user.get("message", "Unable to get account."))
+
+CHECKS = {
+    "redis": check_redis,
+    "database": check_database,
+    "lnbits": check_lnbits,
+    "lnmarkets": check_lnmarkets
+}
+
+async def probe(check) -> dict:
+    start = perf_counter()
+    try:
+        await asyncio.wait_for(check(), HEALTH_CHECK_TIMEOUT)
+    except asyncio.TimeoutError:
+        return { "ok": False, "latency": round((perf_counter() - start) * 1000, 2), "error": "Timed out." }
+    except Exception as error:
+        return { "ok": False, "latency": round((perf_counter() - start) * 1000, 2), "error": str(error) or error.__class__.__name__ }
+    return { "ok": True, "latency": round((perf_counter() - start) * 1000, 2) }
+
+async def readiness() -> dict:
+    """Check every dependency concurrently, the slowest one bounds the
+    time taken by `HEALTH_CHECK_TIMEOUT`.
+    """
+    results = await asyncio.gather(*[probe(check) for check in CHECKS.values()])
+    checks = dict(zip(CHECKS.keys(), results))
+    return { "ready": all([check["ok"] for check in results]), "checks": checks }
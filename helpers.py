@@ -1,7 +1,43 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from functools import partial
+from anyio import to_thread
+from json import dumps, loads
 from time import time
 
+import telemetry
+
 def timestamp() -> int:
     return int(time())
 
 def percentage(x: float, y: float) -> float:
     return (x * y / 100)
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Encode an opaque keyset pagination cursor."""
+    return urlsafe_b64encode(dumps([created_at.isoformat(), id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    created_at, id = loads(urlsafe_b64decode(cursor.encode()))
+    return (datetime.fromisoformat(created_at), int(id))
+
+class Threaded:
+    """Exposes the methods of a blocking client as coroutines that run
+    in a worker thread, so it can stand in for an async client.
+    """
+
+    def __init__(self, client, limiter=None, name: str = ""):
+        self.client = client
+        self.limiter = limiter
+        self.name = name
+    
+    def __getattr__(self, name: str):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            if not (self.name):
+                return await to_thread.run_sync(partial(method, *args, **kwargs), limiter=self.limiter)
+            
+            with telemetry.span(f"{self.name}.{name}"):
+                return await to_thread.run_sync(partial(method, *args, **kwargs), limiter=self.limiter)
+        return call
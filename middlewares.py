@@ -1,24 +1,86 @@
 from fastapi import Request, HTTPException
+from cachetools import LRUCache
+from redis.exceptions import RedisError
+from services import ratelimit
 from helpers import timestamp
-from configs import API_JWT_SECRET
+from configs import API_JWT_SECRET, API_ADMIN_KEY, AUTH_TOKEN_CACHE_SIZE, RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST, RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST
+from math import ceil
 
+import telemetry
+import logging
+import hmac
 import jwt
 
-def isAuthorization(request: Request):
+# Tokens already verified, mapped to their username and expiry. The
+# dependencies checking them are coroutines, never run in a thread.
+tokens = LRUCache(maxsize=AUTH_TOKEN_CACHE_SIZE)
+
+metrics = { "hits": 0, "misses": 0 }
+
+telemetry.Collector("stable_auth_token_cache_total", "Token verifications served from the cache or decoded.", "counter", ("result",), lambda: [
+    (("hit",), metrics["hits"]), 
+    (("miss",), metrics["misses"])
+])
+
+async def isAuthorization(request: Request):
     token = request.headers.get("Authorization", "").replace("Bearer ", "")
     if not (token):
         raise HTTPException(401)
-    else:
-        try:
-            data = jwt.decode(token, API_JWT_SECRET, algorithms=["HS256"])
-        except:
+    
+    cached = tokens.get(token)
+    if (cached):
+        username, exp = cached
+        if (exp < timestamp()):
+            tokens.pop(token, None)
             raise HTTPException(401)
         
-        if not (data):
-            raise HTTPException(401)
-        
-        if (data.get("exp", 0) < timestamp()) or (data.get("username") == None):
-            raise HTTPException(401)
-        else:
-            request.data = { "username": data["username"] }        
-            return request
\ No newline at end of file
+        metrics["hits"] += 1
+        request.data = { "username": username }
+        return request
+    
+    metrics["misses"] += 1
+    try:
+        data = jwt.decode(token, API_JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        raise HTTPException(401)
+    
+    if not (data):
+        raise HTTPException(401)
+    
+    if (data.get("exp", 0) < timestamp()) or (data.get("username") == None):
+        raise HTTPException(401)
+    else:
+        tokens[token] = (data["username"], data["exp"])
+        request.data = { "username": data["username"] }        
+        return request
+
+async def isAdmin(request: Request):
+    key = request.headers.get("X-Admin-Key", "")
+    if not (API_ADMIN_KEY) or not (hmac.compare_digest(key, API_ADMIN_KEY)):
+        raise HTTPException(401)
+    else:
+        return request
+
+async def rateLimit(request: Request, scope: str, username: str = ""):
+    """Refuse the request once the user or the client IP has run out of
+    tokens for `scope`.
+    """
+    buckets = []
+    if (username) and (RATE_LIMIT_USER_RATE > 0):
+        buckets.append((f"{scope}.user.{username}", RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST))
+    
+    if (request.client) and (RATE_LIMIT_IP_RATE > 0):
+        buckets.append((f"{scope}.ip.{request.client.host}", RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST))
+    
+    if not (buckets):
+        return
+    
+    try:
+        wait = await ratelimit.consume(buckets)
+    except RedisError as error:
+        # Fail open, Redis being unavailable must not lock every user out.
+        logging.warning(f"Unable to check rate limit: {error}")
+        return
+    
+    if (wait > 0):
+        raise HTTPException(429, "Too many requests, try again later.", headers={ "Retry-After": str(ceil(wait / 1000)) })
@@ -0,0 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from configs import AUTH_BCRYPT_ROUNDS, AUTH_BCRYPT_THREADS, AUTH_BCRYPT_QUEUE
+from time import perf_counter
+
+import telemetry
+import asyncio
+import bcrypt
+
+# bcrypt releases the GIL, so a dedicated thread pool keeps hashing
+# off the event loop and away from Starlette's shared threadpool.
+executor = ThreadPoolExecutor(max_workers=AUTH_BCRYPT_THREADS, thread_name_prefix="bcrypt")
+
+metrics = { "depth": 0, "completed": 0, "rejected": 0 }
+
+class QueueFull(Exception):
+    pass
+
+def timed(function, submitted: float, *args):
+    telemetry.waits.observe(perf_counter() - submitted, "bcrypt")
+    return function(*args)
+
+async def submit(function, *args):
+    """Run bcrypt work in the pool, refusing it once `AUTH_BCRYPT_QUEUE`
+    jobs are already waiting or running.
+    """
+    if (metrics["depth"] >= AUTH_BCRYPT_QUEUE):
+        metrics["rejected"] += 1
+        raise QueueFull()
+    
+    metrics["depth"] += 1
+    try:
+        with telemetry.span(f"bcrypt.{function.__name__}"):
+            return await asyncio.get_running_loop().run_in_executor(executor, timed, function, perf_counter(), *args)
+    finally:
+        metrics["depth"] -= 1
+        metrics["completed"] += 1
+
+async def hash_password(password: str) -> str:
+    salt = bcrypt.gensalt(rounds=AUTH_BCRYPT_ROUNDS)
+    return (await submit(bcrypt.hashpw, password.encode(), salt)).decode()
+
+async def check_password(password: str, hashed_password: str) -> bool:
+    return await submit(bcrypt.checkpw, password.encode(), hashed_password.encode())
+
+telemetry.pool("bcrypt", lambda: (min(metrics["depth"], AUTH_BCRYPT_THREADS), AUTH_BCRYPT_THREADS, max(metrics["depth"] - AUTH_BCRYPT_THREADS, 0)))
+telemetry.Collector("stable_bcrypt_jobs_total", "bcrypt jobs by outcome.", "counter", ("result",), lambda: [
+    (("completed",), metrics["completed"]), 
+    (("rejected",), metrics["rejected"])
+])
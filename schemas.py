@@ -8,6 +8,7 @@ class UserSchema(BaseModel):
 class SwapSchema(BaseModel):
     currency: str
     value: PositiveFloat
+    quote: Optional[str] = None
 
 class DepositSchema(BaseModel):
     value: PositiveInt
@@ -0,0 +1,79 @@
+from services.redis import aredis
+from configs import CACHE_BALANCE_TTL, CACHE_BALANCE_MAX_AGE
+from json import dumps, loads
+from time import time
+
+import telemetry
+import logging
+import asyncio
+
+class Cache:
+    """Shared upstream value cache stored in Redis.
+
+    Values younger than `ttl` are served as hits. Older values are still
+    served (up to `max_age`) while a single background refresh replaces them.
+    """
+
+    def __init__(self, name: str, loader, ttl: int = CACHE_BALANCE_TTL, max_age: int = CACHE_BALANCE_MAX_AGE):
+        self.name = name
+        self.key = f"stable.cache.{name}"
+        self.loader = loader
+        self.ttl = ttl
+        self.max_age = max_age
+        self.tasks = set()
+        self.metrics = { "hits": 0, "misses": 0, "stale": 0, "refreshes": 0, "errors": 0, "invalidations": 0, "age": 0 }
+
+    async def refresh(self):
+        value = await self.loader()
+        await aredis.set(self.key, dumps({ "value": value, "updated_at": time() }), ex=self.max_age)
+        self.metrics["refreshes"] += 1
+        return value
+
+    async def refresh_background(self):
+        try:
+            await self.refresh()
+        except Exception as error:
+            self.metrics["errors"] += 1
+            logging.warning(f"Unable to refresh cache {self.name}: {error}")
+        finally:
+            await aredis.delete(f"{self.key}.lock")
+
+    async def get(self):
+        cached = await aredis.get(self.key)
+        if not (cached):
+            self.metrics["misses"] += 1
+            return await self.refresh()
+        
+        cached = loads(cached)
+        age = time() - cached["updated_at"]
+        self.metrics["age"] = round(age, 3)
+        if (age <= self.ttl):
+            self.metrics["hits"] += 1
+            return cached["value"]
+        
+        # Only one worker refreshes a stale value at a time.
+        self.metrics["stale"] += 1
+        if (await aredis.set(f"{self.key}.lock", 1, nx=True, ex=max(self.ttl, 1))):
+            task = asyncio.create_task(self.refresh_background())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        return cached["value"]
+
+    async def invalidate(self):
+        await aredis.delete(self.key)
+        self.metrics["invalidations"] += 1
+
+caches = {}
+
+def register(name: str, loader) -> Cache:
+    caches[name] = Cache(name, loader)
+    return caches[name]
+
+def metrics() -> dict:
+    return { name: dict(cache.metrics) for name, cache in caches.items() }
+
+def collect_events() -> list:
+    return [((name, event), value) for name, cache in caches.items() for event, value in cache.metrics.items() if (event != "age")]
+
+telemetry.Collector("stable_cache_events_total", "Shared cache lookups and refreshes by outcome.", "counter", ("cache", "event"), collect_events)
+telemetry.Collector("stable_cache_age_seconds", "Age of the last value served.", "gauge", ("cache",), lambda: [((name,), cache.metrics["age"]) for name, cache in caches.items()])
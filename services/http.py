@@ -0,0 +1,28 @@
+from configs import SERVICES_HTTP_TIMEOUT, SERVICES_HTTP_MAX_CONNECTIONS
+
+import httpx
+
+class PooledClient:
+    """Base of the non-blocking upstream clients, which share one pooled
+    HTTP client against `url`. It is opened by the first request, from the
+    event loop that uses it rather than at import, and closed on shutdown.
+    """
+
+    url = ""
+
+    _client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if (self._client == None):
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                timeout=SERVICES_HTTP_TIMEOUT,
+                limits=httpx.Limits(max_connections=SERVICES_HTTP_MAX_CONNECTIONS)
+            )
+        return self._client
+
+    async def close(self):
+        if (self._client != None):
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,44 @@
+from configs import INVOICE_CACHE_SIZE, INVOICE_DECODE_THREADS
+from cachetools import LRUCache
+from anyio import CapacityLimiter, to_thread
+
+import telemetry
+import bolt11
+
+# Decoded and verified invoices by payment request. The decode itself
+# runs in a thread, the cache is only read and filled back on the loop.
+invoices = LRUCache(maxsize=INVOICE_CACHE_SIZE)
+
+metrics = { "hits": 0, "misses": 0 }
+
+limiter = None
+
+telemetry.Collector("stable_invoice_cache_total", "Invoice decodes served from the cache or decoded.", "counter", ("result",), lambda: [
+    (("hit",), metrics["hits"]), 
+    (("miss",), metrics["misses"])
+])
+
+async def decode(payment_request: str) -> dict:
+    """Decode `payment_request` and check its signature and expiry,
+    raises `bolt11.InvoiceError` when it is invalid.
+    """
+    global limiter
+    invoice = invoices.get(payment_request)
+    if (invoice == None):
+        metrics["misses"] += 1
+        if (limiter == None):
+            limiter = CapacityLimiter(INVOICE_DECODE_THREADS)
+        
+        # Recovering the payee takes milliseconds of pure Python, it runs
+        # in its own small pool to keep the event loop serving requests.
+        with telemetry.span("bolt11.decode"):
+            invoice = await to_thread.run_sync(bolt11.decode, payment_request, limiter=limiter)
+        invoices[payment_request] = invoice
+    else:
+        metrics["hits"] += 1
+    
+    # Checked on every use, a cached invoice may have expired since.
+    bolt11.check_expiry(invoice)
+    return invoice
+
+telemetry.pool("invoices", lambda: telemetry.limiter_usage(limiter) if (limiter) else (0, INVOICE_DECODE_THREADS, 0))
@@ -1,44 +1,134 @@
-from configs import LNBITS_WALLET_ADMIN_KEY, LNBITS_WALLET_INVOICE_KEY, LNBITS_HOST, LNBITS_WEBHOOK_URL
+from configs import LNBITS_WALLET_ADMIN_KEY, LNBITS_WALLET_INVOICE_KEY, LNBITS_HOST, LNBITS_WEBHOOK_URL, LNBITS_PAYMENT_RETRIES, LNBITS_PAYMENT_BACKOFF, DEPOSIT_EXPIRY, SERVICES_ASYNC, SERVICES_HTTP_TIMEOUT
+from services.http import PooledClient
+from services import cache
+from helpers import Threaded
 from lnbits import Lnbits
 
+import telemetry
 import logging
-import sys
-
-lnbits = Lnbits(admin_key=LNBITS_WALLET_ADMIN_KEY, invoice_key=LNBITS_WALLET_INVOICE_KEY, url=LNBITS_HOST)
-try:
-    if (lnbits.get_wallet().get("detail")):
-        raise Exception("Wallet does not exist.")
-except:
-    logging.critical("Unable to connect with Lnbits.")
-    logging.critical("Exit")
-    sys.exit(0)
-
-def pay_invoice(payment_request: str) -> dict:
+import asyncio
+import httpx
+
+class LnbitsBlocking(Lnbits):
+    """`Lnbits` with the lookup of a single payment the client lacks."""
+
+    def __init__(self, admin_key: str, invoice_key: str, url: str):
+        super().__init__(admin_key=admin_key, invoice_key=invoice_key, url=url)
+        self.lookup_key = admin_key
+        self.lookup_url = url
+
+    def get_payment(self, payment_hash: str) -> dict:
+        headers = { "X-Api-Key": self.lookup_key }
+        return httpx.get(f"{self.lookup_url}/v1/payments/{payment_hash}", headers=headers, timeout=SERVICES_HTTP_TIMEOUT).json()
+
+class LnbitsAsync(PooledClient):
+    """Non-blocking counterpart of `Lnbits` sharing a pooled HTTP client."""
+
+    def __init__(self, admin_key: str, invoice_key: str, url: str):
+        self.admin_key = admin_key
+        self.invoice_key = invoice_key
+        self.url = url
+
+    async def request(self, method: str, path: str, admin: bool = False, **kwargs):
+        headers = { "X-Api-Key": self.admin_key if (admin) else self.invoice_key }
+        response = await self.client.request(method, path, headers=headers, **kwargs)
+        telemetry.responses.inc("lnbits", response.status_code)
+        return response.json()
+
+    @telemetry.timed("lnbits.get_wallet")
+    async def get_wallet(self) -> dict:
+        return await self.request("GET", "/v1/wallet")
+
+    @telemetry.timed("lnbits.create_invoice")
+    async def create_invoice(self, amount: int, memo: str = "", webhook: str = "") -> dict:
+        return await self.request("POST", "/v1/payments", json={ "out": False, "amount": amount, "memo": memo, "webhook": webhook })
+
+    @telemetry.timed("lnbits.pay_invoice")
+    async def pay_invoice(self, payment_request: str) -> dict:
+        return await self.request("POST", "/v1/payments", admin=True, json={ "out": True, "bolt11": payment_request })
+
+    @telemetry.timed("lnbits.check_invoice_status")
+    async def check_invoice_status(self, payment_hash: str) -> bool:
+        return (await self.request("GET", f"/v1/payments/{payment_hash}")).get("paid", False)
+
+    @telemetry.timed("lnbits.get_payment")
+    async def get_payment(self, payment_hash: str) -> dict:
+        # The admin key is needed for the details of outgoing payments.
+        return await self.request("GET", f"/v1/payments/{payment_hash}", admin=True)
+
+    @telemetry.timed("lnbits.decode_invoice")
+    async def decode_invoice(self, payment_request: str) -> dict:
+        return await self.request("POST", "/v1/payments/decode", json={ "data": payment_request })
+
+    @telemetry.timed("lnbits.list_payments")
+    async def list_payments(self, limit: int = 10, offset: int = 0) -> list:
+        return await self.request("GET", "/v1/payments", params={ "limit": limit, "offset": offset })
+
+lnbits = LnbitsBlocking(admin_key=LNBITS_WALLET_ADMIN_KEY, invoice_key=LNBITS_WALLET_INVOICE_KEY, url=LNBITS_HOST)
+
+if (SERVICES_ASYNC == True):
+    alnbits = LnbitsAsync(admin_key=LNBITS_WALLET_ADMIN_KEY, invoice_key=LNBITS_WALLET_INVOICE_KEY, url=LNBITS_HOST)
+else:
+    alnbits = Threaded(lnbits, name="lnbits")
+
+async def load_balance() -> int:
+    return round((await alnbits.get_wallet())["balance"] / 1000)
+
+balance = cache.register("lnbits.balance", load_balance)
+
+async def get_balance() -> int:
+    """Wallet balance in sats, served from the shared cache."""
+    return await balance.get()
+
+async def get_payment(payment_hash: str) -> dict:
+    """Look a payment up by hash, waiting with a backoff while it is still
+    in flight. Returns None when it is still pending after the last retry.
+    """
+    delay = LNBITS_PAYMENT_BACKOFF
+    for attempt in range(LNBITS_PAYMENT_RETRIES + 1):
+        if (attempt > 0):
+            await asyncio.sleep(delay)
+            delay *= 2
+        
+        try:
+            payment = await alnbits.get_payment(payment_hash)
+        except Exception as error:
+            logging.warning(f"Unable to look up payment {payment_hash}: {error}")
+            continue
+        
+        if (payment.get("paid") == True) or (payment.get("details", {}).get("pending") == False):
+            return payment
+    return None
+
+async def pay_invoice(payment_request: str) -> dict:
     """Pay lightning invoice."""
-    pay_invoice = lnbits.pay_invoice(payment_request)
+    pay_invoice = await alnbits.pay_invoice(payment_request)
     if not (pay_invoice.get("payment_hash")):
         return { "message": "Unable to pay invoice." }
 
     payment_hash = pay_invoice["payment_hash"]
-    payments = lnbits.list_payments(limit=5)
+    payment = await get_payment(payment_hash)
+    if (payment == None):
+        return { "message": "Payment is still pending.", "payment_hash": payment_hash }
     
-    payment = filter(lambda data: (data["payment_hash"] == payment_hash), payments)
-    payment = list(payment)[0]
-
-    checking_id = payment["checking_id"]
-    preimage = payments["preimage"]
-    fee_sat = round(float(payment["fee"]) / 1000)
+    if (payment.get("paid") != True):
+        return { "message": "Unable to pay invoice.", "payment_hash": payment_hash }
+    
+    details = payment.get("details", {})
+    checking_id = details.get("checking_id", pay_invoice.get("checking_id"))
+    preimage = payment.get("preimage") or details.get("preimage")
     
-    amount = int(str(payment["amount"]).replace("-", ""))
-    amount = round(amount / 1000)
+    # Outgoing amounts and fees are negative millisatoshis.
+    fee_sat = round(abs(float(details.get("fee", 0))) / 1000)
+    amount = round(abs(int(details.get("amount", 0))) / 1000)
     return { "id": checking_id, "preimage": preimage, "amount": amount, "payment_hash": payment_hash, "fee_sat": fee_sat }
 
-def create_invoice(amount: int, memo="", expiry=86400) -> dict:
+async def create_invoice(amount: int, memo="", expiry=DEPOSIT_EXPIRY) -> dict:
     """Create a new lightning invoice containing metadata that will be used in 
     later contracts for debt settlement.
     """
 
-    invoice = lnbits.create_invoice(amount, memo=memo, webhook=LNBITS_WEBHOOK_URL)
+    invoice = await alnbits.create_invoice(amount, memo=memo, webhook=LNBITS_WEBHOOK_URL)
     if not invoice.get("payment_hash"):
         return {"message": invoice}
     
@@ -47,4 +137,4 @@ def create_invoice(amount: int, memo="", expiry=86400) -> dict:
 
     # Get payment request.
     payment_request = invoice["payment_request"]
-    return {"payment_hash": payment_hash, "payment_request": payment_request, "expiry": expiry}
\ No newline at end of file
+    return {"payment_hash": payment_hash, "payment_request": payment_request, "expiry": expiry}
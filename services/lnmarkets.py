@@ -1,4 +1,88 @@
-from lnmarkets.rest import LNMarketsRest
-from configs import LNM_KEY, LNM_NETWORK, LNM_SECRET, LNM_PASSPHRASE
+from lnmarkets.rest import LNMarketsRest, get_hostname
+from configs import LNM_KEY, LNM_NETWORK, LNM_SECRET, LNM_PASSPHRASE, LNM_URL, SERVICES_ASYNC
+from urllib.parse import urlencode
+from services.http import PooledClient
+from services import cache
+from helpers import Threaded
+from base64 import b64encode
+from hashlib import sha256
+from json import dumps, loads
+from time import time
 
-lnmarkets = LNMarketsRest(key=LNM_KEY, secret=LNM_SECRET, network=LNM_NETWORK, passphrase=LNM_PASSPHRASE)
\ No newline at end of file
+import telemetry
+import hmac
+
+# Minimum amount LN Markets accepts for a withdrawal.
+LNMARKETS_WITHDRAW_MIN = 1000
+
+class LNMarketsAsync(PooledClient):
+    """Non-blocking counterpart of `LNMarketsRest` sharing a pooled HTTP
+    client. Methods return the raw response text like the blocking client.
+    """
+
+    def __init__(self, key: str, secret: str, passphrase: str, network: str = "mainnet", version: str = "v1", url: str = ""):
+        self.key = key
+        self.secret = secret
+        self.passphrase = passphrase
+        self.version = version
+        self.url = url or f"https://{get_hostname(network)}/{version}"
+
+    async def request(self, method: str, path: str, params: dict = {}, credentials: bool = False) -> str:
+        headers = { "Content-Type": "application/json" }
+        if (method in ["GET", "DELETE"]):
+            data = urlencode(params)
+        else:
+            data = dumps(params, separators=(",", ":"))
+        
+        if (credentials == True):
+            ts = str(int(time() * 1000))
+            payload = ts + method + "/" + self.version + path + data
+            signature = hmac.new(self.secret.encode(), payload.encode(), sha256).digest()
+            headers["LNM-ACCESS-KEY"] = self.key
+            headers["LNM-ACCESS-PASSPHRASE"] = self.passphrase
+            headers["LNM-ACCESS-TIMESTAMP"] = ts
+            headers["LNM-ACCESS-SIGNATURE"] = b64encode(signature).decode()
+        
+        if (method in ["GET", "DELETE"]):
+            response = await self.client.request(method, f"{path}?{data}" if (data) else path, headers=headers)
+        else:
+            response = await self.client.request(method, path, content=data, headers=headers)
+        
+        telemetry.responses.inc("lnmarkets", response.status_code)
+        return response.text
+
+    @telemetry.timed("lnmarkets.get_user")
+    async def get_user(self) -> str:
+        return await self.request("GET", "/user", credentials=True)
+
+    @telemetry.timed("lnmarkets.deposit")
+    async def deposit(self, params: dict) -> str:
+        return await self.request("POST", "/user/deposit", params, credentials=True)
+
+    @telemetry.timed("lnmarkets.withdraw")
+    async def withdraw(self, params: dict) -> str:
+        return await self.request("POST", "/user/withdraw", params, credentials=True)
+
+    @telemetry.timed("lnmarkets.futures_get_ticker")
+    async def futures_get_ticker(self) -> str:
+        return await self.request("GET", "/futures/ticker")
+
+    @telemetry.timed("lnmarkets.swap")
+    async def swap(self, params: dict) -> str:
+        return await self.request("POST", "/swap", params, credentials=True)
+
+lnmarkets = LNMarketsRest(key=LNM_KEY, secret=LNM_SECRET, network=LNM_NETWORK, passphrase=LNM_PASSPHRASE)
+
+if (SERVICES_ASYNC == True):
+    alnmarkets = LNMarketsAsync(key=LNM_KEY, secret=LNM_SECRET, network=LNM_NETWORK, passphrase=LNM_PASSPHRASE, url=LNM_URL)
+else:
+    alnmarkets = Threaded(lnmarkets, name="lnmarkets")
+
+async def load_balance() -> int:
+    return loads(await alnmarkets.get_user())["balance"]
+
+balance = cache.register("lnmarkets.balance", load_balance)
+
+async def get_balance() -> int:
+    """Exchange account balance in sats, served from the shared cache."""
+    return await balance.get()
@@ -0,0 +1,25 @@
+from configs import PENDING_LEGACY_READS
+from services.redis import aredis
+from json import loads
+
+# Pending deposits are tracked by their Transaction rows and are not
+# stored in Redis. Earlier versions kept each one as a JSON blob under
+# `stable.tx.<payment hash>`, those are only read (and deleted once
+# settled or canceled) until they have expired.
+
+def legacy_key(payment_hash: str) -> str:
+    return f"stable.tx.{payment_hash}"
+
+async def get_many(payment_hashes: list) -> dict:
+    """Look up many legacy pending deposits with a single MGET, missing
+    (settled or expired) ones are left out.
+    """
+    if (PENDING_LEGACY_READS == False) or not (payment_hashes):
+        return {}
+
+    values = await aredis.mget([legacy_key(payment_hash) for payment_hash in payment_hashes])
+    return { payment_hash: loads(value) for payment_hash, value in zip(payment_hashes, values) if (value) }
+
+async def delete_many(payment_hashes: list):
+    if (PENDING_LEGACY_READS == True) and (payment_hashes):
+        await aredis.delete(*[legacy_key(payment_hash) for payment_hash in payment_hashes])
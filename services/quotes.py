@@ -0,0 +1,65 @@
+from services.redis import aredis
+from configs import API_JWT_SECRET, QUOTE_TTL, QUOTE_MAX_SLIPPAGE, SATS
+from helpers import timestamp
+from secrets import token_hex
+from hashlib import sha256
+
+import hmac
+import jwt
+
+# Quotes are signed with their own key so they can never pass as an
+# authorization token.
+KEY = hmac.new(API_JWT_SECRET.encode(), b"quote", sha256).hexdigest()
+
+class QuoteError(Exception):
+    pass
+
+def convert(in_asset: str, value: float, price: float) -> float:
+    """Output of swapping `value` of `in_asset` at `price` USD per BTC."""
+    if (in_asset == "BTC"):
+        return round(value * price / SATS, 2)
+    else:
+        return int(value * SATS / price)
+
+def create(username: str, in_asset: str, out_asset: str, value: float, price: float) -> dict:
+    quote = {
+        "id": token_hex(16),
+        "username": username,
+        "in_asset": in_asset,
+        "out_asset": out_asset,
+        "in_amount": value,
+        "out_amount": convert(in_asset, value, price),
+        "price": price,
+        "max_slippage": QUOTE_MAX_SLIPPAGE,
+        "exp": timestamp() + QUOTE_TTL
+    }
+    return { **quote, "quote": jwt.encode(payload=quote, key=KEY, algorithm="HS256") }
+
+def verify(token: str, username: str, out_asset: str, value: float, price: float) -> dict:
+    """Check a quote still applies to this swap at the current `price`."""
+    try:
+        quote = jwt.decode(token, KEY, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise QuoteError("Quote has expired.")
+    except jwt.PyJWTError:
+        raise QuoteError("Quote is invalid.")
+    
+    if (quote["username"] != username) or (quote["out_asset"] != out_asset) or (quote["in_amount"] != value):
+        raise QuoteError("Quote does not match the swap.")
+    
+    # Only a move against the quoted output is limited.
+    slippage = quote["max_slippage"] / 100
+    if (quote["in_asset"] == "BTC") and (price < quote["price"] * (1 - slippage)):
+        raise QuoteError("Price moved beyond the quote slippage.")
+    
+    if (quote["in_asset"] == "USD") and (price > quote["price"] * (1 + slippage)):
+        raise QuoteError("Price moved beyond the quote slippage.")
+    return quote
+
+async def claim(quote: dict) -> bool:
+    """Mark the quote as used, a quote locks a single swap."""
+    return bool(await aredis.set(f"stable.quote.{quote['id']}", 1, nx=True, ex=QUOTE_TTL + 1))
+
+async def release(quote: dict):
+    """Make a claimed quote usable again, for a swap that was not submitted."""
+    await aredis.delete(f"stable.quote.{quote['id']}")
@@ -0,0 +1,58 @@
+from services.redis import aredis
+from redis.exceptions import NoScriptError
+from hashlib import sha1
+
+# Token buckets stored as hashes of (tokens, ts), refilled at `rate` 
+# tokens per second up to `burst`. A request takes a token from every 
+# bucket or from none, and the wait until it would be allowed is 
+# returned in milliseconds (0 when allowed). Redis time is used so 
+# every worker shares the same clock.
+SCRIPT = """
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local bucket = redis.call("HMGET", key, "tokens", "ts")
+    local available = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(0, now - ts) * rate)
+    if (available < 1) then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+
+if (wait > 0) then
+    return math.ceil(wait * 1000)
+end
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    redis.call("HSET", key, "tokens", tostring(tokens[i] - 1), "ts", tostring(now))
+    redis.call("PEXPIRE", key, math.ceil(burst / rate * 1000))
+end
+return 0
+"""
+
+SHA = sha1(SCRIPT.encode()).hexdigest()
+
+def key(bucket: str) -> str:
+    return f"stable.ratelimit.{bucket}"
+
+async def consume(buckets: list) -> int:
+    """Take a token from every (bucket, rate, burst) in a single atomic 
+    script. Returns 0 when allowed, otherwise the milliseconds to wait.
+    """
+    keys = [key(bucket) for bucket, _, _ in buckets]
+    args = []
+    for _, rate, burst in buckets:
+        args.extend([rate, burst])
+    
+    try:
+        return int(await aredis.evalsha(SHA, len(keys), *keys, *args))
+    except NoScriptError:
+        return int(await aredis.eval(SCRIPT, len(keys), *keys, *args))
@@ -0,0 +1,119 @@
+from services.redis import aredis, pipeline
+from fastapi.encoders import jsonable_encoder
+from fastapi import Request, Response
+from redis.exceptions import RedisError
+from configs import READ_CACHE_TTL, READ_CACHE_FINAL_TTL
+from functools import wraps
+from hashlib import sha1
+from json import dumps, loads
+from time import time
+
+import database
+import logging
+
+# Reads are cached per user and tagged with the user's version, every
+# write bumps the version so older entries are never served again.
+# Versions expire too, their expiry is pushed past the entries' on every
+# bump and cache write, so a version only restarts once none is left.
+VERSION_TTL = READ_CACHE_TTL * 2
+
+def version_key(username: str) -> str:
+    return f"stable.reads.{username}.version"
+
+def key(username: str) -> str:
+    return f"stable.reads.{username}"
+
+def final_key(username: str, name: str) -> str:
+    return f"stable.reads.{username}.final.{name}"
+
+async def bump(*usernames):
+    """Invalidate the cached reads of `usernames`, once their writes 
+    have been committed.
+    """
+    usernames = set(filter(None, usernames))
+    if not (usernames) or (READ_CACHE_TTL == 0):
+        return
+    
+    try:
+        await pipeline([command for username in usernames for command in [
+            ("incr", version_key(username)), 
+            ("expire", version_key(username), VERSION_TTL)
+        ]])
+    except RedisError as error:
+        logging.warning(f"Unable to bump read versions: {error}")
+
+def invalidates(function):
+    """Decorate an endpoint writing to the balances or transactions of the
+    authenticated user, whose reads are invalidated when it returns or fails.
+    """
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            request = kwargs.get("request")
+            if (request != None) and (getattr(request, "data", None)):
+                await bump(request.data["username"])
+    return wrapper
+
+def entry(value, version: str) -> dict:
+    body = dumps(jsonable_encoder(value), separators=(",", ":"))
+    return { "version": version, "etag": f'"{sha1(body.encode()).hexdigest()[:20]}"', "body": body }
+
+def respond(request: Request, entry: dict, cache_control: str) -> Response:
+    headers = { "ETag": entry["etag"], "Cache-Control": cache_control }
+    matches = [etag.strip() for etag in request.headers.get("If-None-Match", "").split(",")]
+    if (entry["etag"] in matches) or ("*" in matches):
+        return Response(status_code=304, headers=headers)
+    return Response(entry["body"], media_type="application/json", headers=headers)
+
+async def get(request: Request, username: str, name: str, loader, final=None) -> Response:
+    """Serve `loader` (run in the database pool) from the read cache of 
+    `username`, answering 304 when `If-None-Match` matches. Values for 
+    which `final(value)` is true never change again and are kept apart 
+    from the versioned entries.
+    """
+    if (READ_CACHE_TTL == 0):
+        return respond(request, entry(await database.run(loader), None), "private, no-cache")
+    
+    commands = [("get", version_key(username)), ("hget", key(username), name)]
+    if (final):
+        commands.append(("get", final_key(username, name)))
+    
+    try:
+        version, cached, *cached_final = await pipeline(commands)
+    except RedisError as error:
+        logging.warning(f"Unable to read cache: {error}")
+        return respond(request, entry(await database.run(loader), None), "private, no-cache")
+    
+    if (cached_final) and (cached_final[0]):
+        return respond(request, loads(cached_final[0]), "private, max-age=31536000, immutable")
+    
+    version = version.decode() if (version) else None
+    if (cached):
+        cached = loads(cached)
+        if (version != None) and (cached["version"] == version):
+            return respond(request, cached, "private, no-cache")
+    
+    value = await database.run(loader)
+    current = entry(value, version)
+    try:
+        if (final) and (final(value)):
+            await aredis.set(final_key(username, name), dumps(current), ex=READ_CACHE_FINAL_TTL)
+            return respond(request, current, "private, max-age=31536000, immutable")
+        
+        if (version == None):
+            # Versions start from the clock, so entries left behind by an
+            # evicted version can not be mistaken for current ones.
+            await aredis.set(version_key(username), int(time() * 1000), nx=True, ex=VERSION_TTL)
+        else:
+            # The version was read before loading, a write committed in 
+            # between bumps it and makes this entry stale right away.
+            await pipeline([
+                ("hset", key(username), name, dumps(current)), 
+                ("expire", key(username), READ_CACHE_TTL),
+                ("expire", version_key(username), VERSION_TTL)
+            ])
+    except RedisError as error:
+        logging.warning(f"Unable to write cache: {error}")
+    return respond(request, current, "private, no-cache")
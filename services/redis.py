@@ -1,4 +1,59 @@
-from configs import REDIS_HOST, REDIS_PORT, REDIS_PASS
-from redis import StrictRedis
+from configs import REDIS_HOST, REDIS_PORT, REDIS_PASS, REDIS_SOCKET, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT, REDIS_CONNECT_TIMEOUT, REDIS_HEALTH_CHECK_INTERVAL, SERVICES_ASYNC
+from redis.asyncio import StrictRedis as AsyncStrictRedis, ConnectionPool as AsyncConnectionPool
+from redis.asyncio.connection import UnixDomainSocketConnection as AsyncUnixDomainSocketConnection
+from redis import StrictRedis, ConnectionPool, UnixDomainSocketConnection
+from anyio import to_thread
+from helpers import Threaded
 
-redis = StrictRedis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASS)
\ No newline at end of file
+import telemetry
+
+def create_pool(pool_class, unix_connection_class):
+    """Create a bounded connection pool that fails fast when Redis is
+    unreachable, over TCP or a Unix socket when `REDIS_SOCKET` is set.
+    """
+    options = {
+        "password": REDIS_PASS, 
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "retry_on_timeout": False
+    }
+    if (REDIS_SOCKET):
+        return pool_class(connection_class=unix_connection_class, path=REDIS_SOCKET, **options)
+    else:
+        return pool_class(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=REDIS_CONNECT_TIMEOUT, **options)
+
+class TimedRedis(StrictRedis):
+    """Records every command round trip as a `redis.<COMMAND>` stage."""
+
+    def execute_command(self, *args, **options):
+        with telemetry.span(f"redis.{args[0]}"):
+            return super().execute_command(*args, **options)
+
+class AsyncTimedRedis(AsyncStrictRedis):
+    async def execute_command(self, *args, **options):
+        with telemetry.span(f"redis.{args[0]}"):
+            return await super().execute_command(*args, **options)
+
+redis = TimedRedis(connection_pool=create_pool(ConnectionPool, UnixDomainSocketConnection))
+
+if (SERVICES_ASYNC == True):
+    aredis = AsyncTimedRedis(connection_pool=create_pool(AsyncConnectionPool, AsyncUnixDomainSocketConnection))
+else:
+    aredis = Threaded(redis)
+
+async def pipeline(commands: list) -> list:
+    """Send a list of (command, *args) tuples in a single round trip."""
+    with telemetry.span("redis.pipeline"):
+        if (SERVICES_ASYNC == True):
+            pipe = aredis.pipeline(transaction=False)
+            for command, *args in commands:
+                getattr(pipe, command)(*args)
+            return await pipe.execute()
+        
+        def execute():
+            pipe = redis.pipeline(transaction=False)
+            for command, *args in commands:
+                getattr(pipe, command)(*args)
+            return pipe.execute()
+        return await to_thread.run_sync(execute)
@@ -0,0 +1,43 @@
+from configs import WITHDRAW_DEADLINE
+from services.lnmarkets import LNMARKETS_WITHDRAW_MIN
+from services import lnbits, lnmarkets
+
+import telemetry
+import logging
+import asyncio
+
+async def within(name: str, coroutine, deadline: float = WITHDRAW_DEADLINE):
+    """Await `coroutine` for at most `deadline` seconds, None when it
+    failed or ran out of time.
+    """
+    try:
+        with telemetry.span(f"routing.{name}"):
+            return await asyncio.wait_for(coroutine, deadline)
+    except asyncio.TimeoutError:
+        logging.warning(f"Balance of {name} took longer than {deadline}s.")
+    except Exception as error:
+        logging.warning(f"Unable to get the balance of {name}: {error}")
+    return None
+
+async def plan(amount_sat: int) -> str:
+    """Pick the wallet paying a withdrawal of `amount_sat`: "lnbits",
+    "lnmarkets" or None when neither can.
+
+    Both balances are fetched at once, LNbits is preferred and LN Markets
+    hedges it when LNbits is short, failing or past its deadline.
+    """
+    hedge = asyncio.create_task(within("lnmarkets", lnmarkets.get_balance()))
+    try:
+        lnbits_balance = await within("lnbits", lnbits.get_balance())
+        if (lnbits_balance != None) and (lnbits_balance > amount_sat):
+            return "lnbits"
+        
+        if (amount_sat < LNMARKETS_WITHDRAW_MIN):
+            return None
+        
+        lnmarkets_balance = await hedge
+        if (lnmarkets_balance != None) and (lnmarkets_balance > amount_sat):
+            return "lnmarkets"
+        return None
+    finally:
+        hedge.cancel()
@@ -0,0 +1,200 @@
+from contextvars import ContextVar
+from starlette.routing import Match
+from functools import wraps
+from threading import Lock
+from bisect import bisect_left
+from time import perf_counter
+
+# Latency buckets in seconds, shared by every histogram.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Route template of the request being served, background work is
+# recorded under "background".
+endpoint = ContextVar("endpoint", default="background")
+
+registry = []
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if (extra):
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if (labels) else ""
+
+class Counter:
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = Lock()
+        registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = Lock()
+        registry.append(self)
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if (series == None):
+                # Per bucket counts (plus +Inf), sum and count.
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            values = [(labels, list(series[0]), series[1], series[2]) for labels, series in self.values.items()]
+
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bucket, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bucket}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {round(total, 6)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+class Collector:
+    """Metric read from existing state when scraped. `collect` returns a
+    list of (label values, value) pairs.
+    """
+
+    def __init__(self, name: str, description: str, typeof: str, labels: tuple, collect):
+        self.name = name
+        self.description = description
+        self.typeof = typeof
+        self.labels = labels
+        self.collect = collect
+        registry.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.typeof}"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+requests = Histogram("stable_http_request_seconds", "HTTP request latency.", ("endpoint", "method", "status"))
+stages = Histogram("stable_stage_seconds", "Latency of each stage of a request: upstream calls, database work and Redis round trips.", ("endpoint", "stage"))
+errors = Counter("stable_stage_errors_total", "Stages that raised an exception.", ("endpoint", "stage"))
+responses = Counter("stable_upstream_responses_total", "Upstream HTTP responses by status code.", ("service", "status"))
+waits = Histogram("stable_threadpool_wait_seconds", "Time spent waiting for a worker thread.", ("pool",))
+
+class Span:
+    """Times a stage of the current request, as a context manager (sync or
+    async) or through `timed`.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, typeof, value, traceback):
+        current = endpoint.get()
+        stages.observe(perf_counter() - self.start, current, self.stage)
+        if (typeof != None):
+            errors.inc(current, self.stage)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, typeof, value, traceback):
+        return self.__exit__(typeof, value, traceback)
+
+pools = {}
+
+def pool(name: str, usage):
+    """Register a thread pool, `usage` returns (in use, capacity, waiting)."""
+    pools[name] = usage
+
+def limiter_usage(limiter) -> tuple:
+    if (limiter == None):
+        return (0, 0, 0)
+    return (limiter.borrowed_tokens, limiter.total_tokens, limiter.statistics().tasks_waiting)
+
+Collector("stable_threadpool_in_use", "Worker threads busy.", "gauge", ("pool",), lambda: [((name,), usage()[0]) for name, usage in pools.items()])
+Collector("stable_threadpool_capacity", "Worker threads available.", "gauge", ("pool",), lambda: [((name,), usage()[1]) for name, usage in pools.items()])
+Collector("stable_threadpool_waiting", "Jobs waiting for a worker thread.", "gauge", ("pool",), lambda: [((name,), usage()[2]) for name, usage in pools.items()])
+
+def span(stage: str) -> Span:
+    return Span(stage)
+
+def timed(stage: str):
+    """Decorate a coroutine function to be recorded as `stage`."""
+    def decorator(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            with Span(stage):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class Middleware:
+    """ASGI middleware recording the latency of every request and exposing
+    its route template to the stages it runs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def route(self, scope: dict) -> str:
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if (match == Match.FULL):
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http"):
+            return await self.app(scope, receive, send)
+
+        path = self.route(scope)
+        token = endpoint.set(path)
+        status = [500]
+
+        async def send_wrapper(message):
+            if (message["type"] == "http.response.start"):
+                status[0] = message["status"]
+            await send(message)
+
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests.observe(perf_counter() - start, path, scope["method"], status[0])
+            endpoint.reset(token)
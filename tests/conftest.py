@@ -0,0 +1,74 @@
+"""Fixtures shared by the tests.
+
+    python -m pytest tests
+"""
+
+from secrets import token_hex
+from os import environ, path
+
+import asyncio
+import pytest
+import sys
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+# Required by the configuration, any value will do here.
+SECRETS = ["API_JWT_SECRET", "LNM_KEY", "LNM_SECRET", "LNM_PASSPHRASE", "LNBITS_WALLET_ADMIN_KEY", "LNBITS_WALLET_INVOICE_KEY"]
+
+@pytest.fixture(scope="session")
+def database(tmp_path_factory):
+    """The database module on a new SQLite database, or on the one of
+    TEST_DATABASE_URL (e.g. a local PostgreSQL). The app modules read their
+    configuration when first imported, so they are imported once it is
+    set here.
+    """
+    url = environ.get("TEST_DATABASE_URL") or f"sqlite:///{tmp_path_factory.mktemp('database')}/database.db"
+    with pytest.MonkeyPatch.context() as patch:
+        for name in SECRETS:
+            patch.setenv(name, environ.get(name, "test"))
+        patch.setenv("DATABASE_URL", url)
+
+        import database
+        database.prepare()
+        database.setup()
+    return database
+
+@pytest.fixture
+def run(database):
+    """Run a coroutine on a new event loop."""
+    from services.redis import aredis
+    from configs import SERVICES_ASYNC
+
+    async def scoped(coroutine):
+        try:
+            return await coroutine
+        finally:
+            # Pooled connections belong to the loop they were opened on.
+            if (SERVICES_ASYNC == True):
+                await aredis.connection_pool.disconnect()
+
+    def run(coroutine):
+        # So does the thread limiter.
+        database.limiter = None
+        return asyncio.run(scoped(coroutine))
+    return run
+
+@pytest.fixture
+def open_job(database):
+    """Journal a job of a new user at `step`, funded with the `amount` it
+    debits. Returns the job as read back from the journal.
+    """
+    def open_job(typeof: str, step: str, params: dict, currency: str, amount: int) -> dict:
+        username = f"test{token_hex(4)}"
+        jobid = token_hex(16)
+        database.credit(username, currency, amount)
+        assert database.open_job(jobid, username, typeof, step, dict(params, in_asset=currency, debited=amount), currency, amount)
+        return database.get_job(jobid)
+    return open_job
+
+@pytest.fixture
+def balance(database):
+    def balance(username: str, currency: str) -> int:
+        row = database.Balance.get_or_none((database.Balance.username == username) & (database.Balance.currency == currency))
+        return row.balance if (row) else 0
+    return balance
@@ -0,0 +1,64 @@
+"""The BOLT11 decoder against the test vectors of the spec."""
+
+from benchmarks import mocks
+
+import pytest
+import bolt11
+
+# Valid invoices of the BOLT11 spec, signed by this node.
+PAYEE = "03e7156ae33b0a208d0744199163177e909e80176e55d97a2f221ede0f934dd9ad"
+PAYMENT_HASH = "0001020304050607080900010203040506070809000102030405060708090102"
+DATE = 1496314658
+
+VECTORS = [
+    # Donation of any amount.
+    ("lnbc1pvjluezpp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqdpl2pkx2ctnv5sxxmmwwd5kgetjypeh2ursdae8g6twvus8g6rfwvs8qun0dfjkxaq8rkx3yf5tcsyz3d73gafnh3cax9rn449d9p5uxz9ezhhypd0elx87sjle52x86fux2ypatgddc6k63n7erqz25le42c4u4ecky03ylcqca784w",
+        { "currency": "bc", "amount_msat": None, "description": "Please consider supporting this project", "expiry": 3600 }),
+    # $3 for a cup of coffee within one minute.
+    ("lnbc2500u1pvjluezpp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqdq5xysxxatsyp3k7enxv4jsxqzpuaztrnwngzn3kdzw5hydlzf03qdgm2hdq27cqv3agm2awhz5se903vruatfhq77w3ls4evs3ch9zw97j25emudupq63nyw24cg27h2rspfj9srp",
+        { "currency": "bc", "amount_msat": 250000000, "description": "1 cup coffee", "expiry": 60 }),
+    # The same invoice in upper case.
+    ("LNBC2500U1PVJLUEZPP5QQQSYQCYQ5RQWZQFQQQSYQCYQ5RQWZQFQQQSYQCYQ5RQWZQFQYPQDQ5XYSXXATSYP3K7ENXV4JSXQZPUAZTRNWNGZN3KDZW5HYDLZF03QDGM2HDQ27CQV3AGM2AWHZ5SE903VRUATFHQ77W3LS4EVS3CH9ZW97J25EMUDUPQ63NYW24CG27H2RSPFJ9SRP",
+        { "currency": "bc", "amount_msat": 250000000, "description": "1 cup coffee", "expiry": 60 }),
+    # $24 for a list of things, described by its hash.
+    ("lnbc20m1pvjluezpp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqhp58yjmdan79s6qqdhdzgynm4zwqd5d7xmw5fk98klysy043l2ahrqscc6gd6ql3jrc5yzme8v4ntcewwz5cnw92tz0pc8qcuufvq7khhr8wpald05e92xw006sq94mg8v2ndf4sefvf9sygkshp5zfem29trqq2yxxz7",
+        { "currency": "bc", "amount_msat": 2000000000, "description_hash": "3925b6f67e2c340036ed12093dd44e0368df1b6ea26c53dbe4811f58fd5db8c1" }),
+    # The same on testnet, with a fallback address.
+    ("lntb20m1pvjluezhp58yjmdan79s6qqdhdzgynm4zwqd5d7xmw5fk98klysy043l2ahrqspp5qqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqqqsyqcyq5rqwzqfqypqfpp3x9et2e20v6pu37c5d9vax37wxq72un98kmzzhznpurw9sgl2v0nklu2g4d0keph5t7tj9tcqd8rexnd07ux4uv2cjvcqwaxgj7v4uwn5wmypjd5n69z2xm3xgksg28nwht7f6zspwp3f9t",
+        { "currency": "tb", "amount_msat": 2000000000, "description_hash": "3925b6f67e2c340036ed12093dd44e0368df1b6ea26c53dbe4811f58fd5db8c1" })
+]
+
+def invalid_vectors() -> list:
+    coffee = VECTORS[1][0]
+    other = bytes.fromhex("11" * 32)
+    return [
+        ("bad checksum", coffee[:-1] + ("q" if (coffee[-1] != "q") else "p")),
+        ("mixed case", coffee[:10].upper() + coffee[10:]),
+        ("bad character", coffee[:20] + "b" + coffee[21:]),
+        ("no separator", "lnbc2500upvjluez"),
+        ("sub-millisatoshi amount", bolt11.bech32_encode("lnbc25p", bolt11.bech32_decode(coffee)[1])),
+        ("payee mismatch", mocks.encode_invoice("bc", 1000, DATE, [("p", PAYMENT_HASH), ("n", bytes.fromhex(PAYEE))], other)),
+        ("no payment hash", mocks.encode_invoice("bc", 1000, DATE, [("d", "coffee")], other))
+    ]
+
+@pytest.mark.parametrize("payment_request, expected", VECTORS)
+def test_valid(payment_request, expected):
+    invoice = bolt11.decode(payment_request)
+    expected = dict(expected, payee=PAYEE, payment_hash=PAYMENT_HASH, date=DATE)
+    assert { key: invoice[key] for key in expected } == expected
+
+@pytest.mark.parametrize("name, payment_request", invalid_vectors())
+def test_invalid(name, payment_request):
+    with pytest.raises(bolt11.InvoiceError):
+        bolt11.decode(payment_request)
+
+def test_signed_by_the_mock():
+    payment_request = mocks.encode_invoice("bc", 1000, DATE, [("p", PAYMENT_HASH)], mocks.INVOICE_KEY)
+    invoice = bolt11.decode(payment_request)
+    assert (invoice["amount_msat"], invoice["payment_hash"]) == (1000, PAYMENT_HASH)
+
+def test_expired():
+    invoice = bolt11.decode(VECTORS[1][0])
+    bolt11.check_expiry(invoice, DATE + 59)
+    with pytest.raises(bolt11.InvoiceError):
+        bolt11.check_expiry(invoice)
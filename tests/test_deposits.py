@@ -0,0 +1,24 @@
+"""Deposits are credited once, however many times they are settled."""
+
+from secrets import token_hex
+
+def test_pending_deposit_is_credited_once(database, balance):
+    username, payment_hash = f"test{token_hex(4)}", token_hex(32)
+    database.Transaction.create(txid=payment_hash, username=username, destination=username, currency="BTC", value=1000, status="pending", typeof="deposit")
+    assert database.settle_deposits([(username, payment_hash, 2000)]) == [payment_hash]
+    assert database.settle_deposits([(username, payment_hash, 2000)]) == []
+    assert balance(username, "BTC") == 2000
+
+def test_legacy_deposit_is_credited_once(database, balance):
+    username, payment_hash = f"test{token_hex(4)}", token_hex(32)
+    assert database.settle_deposits([(username, payment_hash, 2000), (username, payment_hash, 2000)]) == [payment_hash]
+    assert database.settle_deposits([(username, payment_hash, 2000)]) == []
+    assert balance(username, "BTC") == 2000
+    assert database.Transaction.select().where(database.Transaction.txid == payment_hash).count() == 1
+
+def test_canceled_deposit_is_not_credited(database, balance):
+    username, payment_hash = f"test{token_hex(4)}", token_hex(32)
+    database.Transaction.create(txid=payment_hash, username=username, destination=username, currency="BTC", value=1000, status="pending", typeof="deposit")
+    database.cancel_deposits([payment_hash])
+    assert database.settle_deposits([(username, payment_hash, 2000)]) == []
+    assert balance(username, "BTC") == 0
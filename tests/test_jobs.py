@@ -0,0 +1,119 @@
+"""Recovery of journaled swaps and withdrawals."""
+
+from datetime import datetime, timedelta
+from secrets import token_hex
+
+import pytest
+
+@pytest.fixture
+def jobs(database):
+    from workers import jobs
+    return jobs
+
+@pytest.fixture
+def lnbits(monkeypatch, jobs):
+    """Answer the LNbits lookup of the payment of `job` with `payment`."""
+    def lnbits(job: dict, payment: dict):
+        async def get_payment(payment_hash: str) -> dict:
+            assert payment_hash == job["params"]["payment_hash"]
+            return payment
+        monkeypatch.setattr(jobs.alnbits, "get_payment", get_payment)
+    return lnbits
+
+@pytest.fixture
+def top_up(database, open_job):
+    """A swap interrupted while paying its LN Markets top-up."""
+    params = { "out_asset": "USD", "value": 10000, "quoted": None, "fee_sat": 100, "top_up": 10000, "payment_request": "lnbc", "payment_hash": token_hex(32) }
+    return open_job("swap", "paying", params, "BTC", database.to_units("BTC", 10100))
+
+@pytest.fixture
+def withdrawal(database, open_job):
+    """A withdrawal of 10000 sats with a 100 sats fee reserve, at `step`."""
+    def withdrawal(step: str, wallet: str = "lnbits") -> dict:
+        params = { "payment_request": "lnbc", "payment_hash": token_hex(32), "amount_sat": 10000, "fee_sat": 100, "wallet": wallet }
+        return open_job("withdraw", step, params, "BTC", database.to_units("BTC", 10100))
+    return withdrawal
+
+def test_paid_top_up_is_charged_its_fee_and_swapped(monkeypatch, jobs, lnbits, top_up, database, balance, run):
+    async def swap(params: dict) -> str:
+        assert params["in_amount"] == 10000
+        return '{"exchange_rate": 20000, "out_amount": 2}'
+
+    monkeypatch.setattr(jobs.alnmarkets, "swap", swap)
+    lnbits(top_up, { "paid": True, "details": { "fee": -2000, "pending": False } })
+    assert run(jobs.resume(top_up))
+
+    job = database.get_job(top_up["id"])
+    assert (job["status"], job["params"]["fee_sat"]) == ("settled", 2)
+    assert balance(top_up["username"], "BTC") == database.to_units("BTC", 98)
+    assert balance(top_up["username"], "USD") == database.to_units("USD", 2)
+
+def test_top_up_fee_above_the_reserve_is_absorbed(monkeypatch, jobs, lnbits, top_up, database, balance, run):
+    async def swap(params: dict) -> str:
+        return '{"exchange_rate": 20000, "out_amount": 2}'
+
+    monkeypatch.setattr(jobs.alnmarkets, "swap", swap)
+    lnbits(top_up, { "paid": True, "details": { "fee": -200000, "pending": False } })
+    assert run(jobs.resume(top_up))
+
+    job = database.get_job(top_up["id"])
+    assert (job["status"], job["params"]["fee_sat"]) == ("settled", 100)
+    assert balance(top_up["username"], "BTC") == 0
+
+def test_failed_top_up_is_refunded(jobs, lnbits, top_up, database, balance, run):
+    lnbits(top_up, { "paid": False, "details": { "pending": False } })
+    assert run(jobs.resume(top_up))
+    assert database.get_job(top_up["id"])["status"] == "failed"
+    assert balance(top_up["username"], "BTC") == database.to_units("BTC", 10100)
+
+def test_top_up_in_flight_is_checked_again(jobs, lnbits, top_up, database, balance, run):
+    lnbits(top_up, { "paid": False, "details": { "pending": True } })
+    assert run(jobs.resume(top_up)) == False
+    assert database.get_job(top_up["id"])["status"] == "running"
+    assert balance(top_up["username"], "BTC") == 0
+
+def test_top_up_in_flight_for_too_long_is_reviewed(jobs, lnbits, top_up, database, balance, run):
+    lnbits(top_up, { "paid": False, "details": { "pending": True } })
+    assert run(jobs.resume(dict(top_up, created_at=datetime.now() - timedelta(days=1))))
+    assert database.get_job(top_up["id"])["status"] == "review"
+    assert balance(top_up["username"], "BTC") == 0
+
+def test_paid_withdrawal_is_settled(jobs, lnbits, withdrawal, database, balance, run):
+    job = withdrawal("paying")
+    lnbits(job, { "paid": True, "details": { "fee": -1000, "pending": False } })
+    assert run(jobs.resume(job))
+    assert database.get_job(job["id"])["status"] == "settled"
+    assert database.Transaction.get(database.Transaction.txid == job["params"]["payment_hash"]).username == job["username"]
+    assert balance(job["username"], "BTC") == 0
+
+def test_withdrawal_paid_from_lnmarkets_is_reviewed(jobs, withdrawal, database, balance, run):
+    job = withdrawal("paying", "lnmarkets")
+    assert run(jobs.resume(job))
+    assert database.get_job(job["id"])["status"] == "review"
+    assert balance(job["username"], "BTC") == 0
+
+def test_debited_withdrawal_is_refunded_by_recovery(jobs, withdrawal, database, balance, run):
+    job = withdrawal("debited")
+    assert run(jobs.resume(job))
+    assert database.get_job(job["id"])["status"] == "failed"
+    assert balance(job["username"], "BTC") == database.to_units("BTC", 10100)
+
+def test_withdrawal_failing_before_paying_is_refunded(monkeypatch, jobs, withdrawal, database, balance, run):
+    def advance_job(*args):
+        raise Exception("database is locked")
+
+    monkeypatch.setattr(database, "advance_job", advance_job)
+    job = withdrawal("debited")
+    run(jobs.run(job))
+    assert database.get_job(job["id"])["status"] == "failed"
+    assert balance(job["username"], "BTC") == database.to_units("BTC", 10100)
+
+def test_withdrawal_failing_while_paying_is_left_for_recovery(monkeypatch, jobs, withdrawal, database, balance, run):
+    async def pay_invoice(payment_request: str) -> dict:
+        raise TimeoutError("LNbits did not answer in time.")
+
+    monkeypatch.setattr(jobs.alnbits, "pay_invoice", pay_invoice)
+    job = withdrawal("debited")
+    run(jobs.run(job))
+    assert (database.get_job(job["id"])["status"], database.get_job(job["id"])["step"]) == ("running", "paying")
+    assert balance(job["username"], "BTC") == 0
@@ -0,0 +1,84 @@
+"""A swap batch whose upstream outcome is unknown must not be refunded."""
+
+import pytest
+
+@pytest.fixture
+def swaps(database):
+    from workers import swaps
+    return swaps
+
+@pytest.fixture
+def swap(monkeypatch, swaps, database, open_job, run):
+    """Run a one swap batch against `upstream`, returns the job as it was
+    left, the error the swap failed with and the job before it ran.
+    """
+    async def index() -> float:
+        return 20000.0
+
+    async def no_top_up(amount: int) -> int:
+        return 0
+
+    def swap(upstream, top_up=no_top_up) -> tuple:
+        monkeypatch.setattr(swaps.prices, "get_index", index)
+        monkeypatch.setattr(swaps, "top_up", top_up)
+        monkeypatch.setattr(swaps.alnmarkets, "swap", upstream)
+        monkeypatch.setattr(swaps, "SWAP_BATCH_WINDOW", 0)
+
+        debited = database.to_units("BTC", 10000)
+        params = { "out_asset": "USD", "value": 10000, "quoted": None, "fee_sat": 0 }
+        job = open_job("swap", "batched", params, "BTC", debited)
+
+        async def submit():
+            try:
+                await swaps.submit(job["username"], "BTC", "USD", 10000, debited, None, job["id"])
+            except Exception as error:
+                return error
+
+        error = run(submit())
+        return (database.get_job(job["id"]), error)
+    return swap
+
+async def timeout(params: dict) -> str:
+    raise TimeoutError("LN Markets did not answer in time.")
+
+async def rejected(params: dict) -> str:
+    return '{"message": "Insufficient balance."}'
+
+async def failed_top_up(amount: int) -> int:
+    raise Exception("Unable to pay the LN Markets deposit.")
+
+def test_unknown_outcome_is_left_for_review(swap, swaps, balance):
+    job, error = swap(timeout)
+    assert isinstance(error, swaps.SwapPending)
+    assert (job["status"], job["step"]) == ("running", "swapping")
+    assert balance(job["username"], "BTC") == 0
+
+def test_unknown_outcome_is_not_refunded_by_recovery(swap, database, balance, run):
+    from workers import jobs
+
+    job, _ = swap(timeout)
+    assert run(jobs.resume(job))
+    assert database.get_job(job["id"])["status"] == "review"
+    assert balance(job["username"], "BTC") == 0
+
+def test_rejected_swap_is_refunded(swap, database, balance):
+    job, _ = swap(rejected)
+    assert (job["status"], job["step"]) == ("failed", "swapping")
+    assert balance(job["username"], "BTC") == database.to_units("BTC", 10000)
+
+def test_failed_top_up_is_refunded(swap, database, balance):
+    job, _ = swap(timeout, failed_top_up)
+    assert (job["status"], job["step"]) == ("failed", "batched")
+    assert balance(job["username"], "BTC") == database.to_units("BTC", 10000)
+
+def test_fee_above_the_reserve_is_absorbed(swap, database, balance):
+    async def accepted(params: dict) -> str:
+        return '{"exchange_rate": 20000, "out_amount": 2}'
+
+    async def expensive_top_up(amount: int) -> int:
+        return 50
+
+    job, _ = swap(accepted, expensive_top_up)
+    assert job["status"] == "settled"
+    assert balance(job["username"], "BTC") == 0
+    assert balance(job["username"], "USD") == database.to_units("USD", 2)
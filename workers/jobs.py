@@ -0,0 +1,309 @@
+from configs import JOB_RECOVERY_INTERVAL, JOB_STALE_AFTER, JOB_REVIEW_AFTER
+from services.lnmarkets import alnmarkets
+from services.lnbits import alnbits
+from services.redis import aredis
+from services import lnbits, lnmarkets, reads, invoices
+from datetime import datetime, timedelta
+from workers import swaps
+from secrets import token_hex
+from json import loads
+
+import database
+import logging
+import asyncio
+
+ERRORS = {
+    "swap": "It was not possible to swap the exchange.",
+    "withdraw": "Unable to pay invoice."
+}
+
+# Steps before any upstream call that moves funds, a job interrupted
+# there is simply compensated.
+SAFE_STEPS = ["debited", "batched"]
+
+# Jobs running in this process, by id.
+tasks = {}
+
+task = None
+
+class JobError(Exception):
+    """A step failed for good, the job is compensated."""
+
+class JobPending(Exception):
+    """The outcome of a step is not known yet, recovery checks it later."""
+
+async def advance(job: dict, step: str, refund: int = 0, **params):
+    """Journal the next step of `job` before the work it leads to."""
+    job["params"].update(params)
+    refund = (job["username"], job["params"]["in_asset"], refund) if (refund) else None
+    if not (await database.run(database.advance_job, job["id"], job["step"], step, job["params"], refund)):
+        raise database.StaleJob(job["id"])
+    job["step"] = step
+
+async def compensate(job: dict, error: str) -> bool:
+    params = job["params"]
+    return await database.run(database.compensate_job, job["id"], [job["step"]], job["username"], params["in_asset"], params["debited"], error)
+
+async def review(job: dict):
+    logging.error(f"Job {job['id']} stopped at {job['step']}, the upstream outcome is unknown.")
+    await database.run(database.finish_job, job["id"], [job["step"]], "review", None, "Needs review, the upstream outcome is unknown.")
+
+async def swap_top_up(job: dict):
+    """Pay the LN Markets deposit invoice covering the swap from LNbits."""
+    params = job["params"]
+    if (params["top_up"] <= 0):
+        return await advance(job, "paid")
+
+    payment_request = loads(await alnmarkets.deposit({ "amount": params["top_up"] }))["paymentRequest"]
+    await advance(job, "paying", payment_request=payment_request, payment_hash=(await invoices.decode(payment_request))["payment_hash"])
+
+    pay_invoice = await lnbits.pay_invoice(payment_request)
+    await lnbits.balance.invalidate()
+    await lnmarkets.balance.invalidate()
+    if (pay_invoice.get("message") == "Payment is still pending."):
+        raise JobPending(job["id"])
+
+    if (pay_invoice.get("message")):
+        raise JobError(ERRORS["swap"])
+    await swap_paid(job, pay_invoice["fee_sat"])
+
+async def swap_paid(job: dict, fee_sat: int):
+    # Charge the routing fee actually paid instead of the estimate, up to
+    # the reserve debited for it.
+    params = job["params"]
+    fee_sat = min(fee_sat, params["fee_sat"])
+    charged = database.to_units(params["in_asset"], params["value"] + fee_sat)
+    await advance(job, "paid", refund=params["debited"] - charged, fee_sat=fee_sat, debited=charged)
+
+async def swap_execute(job: dict):
+    params = job["params"]
+    await advance(job, "swapping")
+
+    swap = await alnmarkets.swap({ "in_asset": params["in_asset"], "out_asset": params["out_asset"], "in_amount": params["value"] })
+    await lnmarkets.balance.invalidate()
+    if not (swap):
+        raise JobError(ERRORS["swap"])
+
+    swap = loads(swap)
+    if not (swap.get("exchange_rate")):
+        raise JobError(ERRORS["swap"])
+
+    # A quote locks the output, the difference is borne by the treasury.
+    out_amount = params["quoted"] if (params["quoted"] != None) else float(swap["out_amount"])
+    await database.run(settle_swap, job, out_amount)
+
+def settle_swap(job: dict, out_amount: float):
+    params = job["params"]
+    username = job["username"]
+    in_asset, out_asset = params["in_asset"], params["out_asset"]
+    with database.atomic():
+        if not (database.finish_job(job["id"], ["swapping"], "settled", { "coins": out_amount, "currency": out_asset })):
+            raise database.StaleJob(job["id"])
+
+        database.credit(username, out_asset, database.to_units(out_asset, out_amount))
+        database.Transaction.create(
+            txid=token_hex(32),
+            username=username,
+            destination=username,
+            currency=in_asset,
+            fee=database.to_units(in_asset, params["fee_sat"]),
+            value=database.to_units(in_asset, params["value"]),
+            status="settled",
+            typeof="withdraw"
+        )
+        database.Transaction.create(
+            txid=token_hex(32),
+            username=username,
+            destination=username,
+            currency=out_asset,
+            value=database.to_units(out_asset, out_amount),
+            status="settled",
+            typeof="deposit"
+        )
+
+async def swap_batch(job: dict):
+    """Hand the swap to the batcher, which settles or refunds the job."""
+    params = job["params"]
+    try:
+        await swaps.submit(job["username"], params["in_asset"], params["out_asset"], params["value"], params["debited"], params["quoted"], job["id"])
+    except swaps.SwapPending:
+        job["step"] = "swapping"
+        raise JobPending(job["id"])
+    job["step"] = "swapping"
+
+async def withdraw_pay(job: dict):
+    params = job["params"]
+    if (params.get("wallet") == None):
+        raise JobError(ERRORS["withdraw"])
+
+    # The wallet is journaled with this step, recovery needs it.
+    await advance(job, "paying")
+    if (params["wallet"] == "lnbits"):
+        pay = await alnbits.pay_invoice(params["payment_request"])
+        await lnbits.balance.invalidate()
+    else:
+        pay = await alnmarkets.withdraw({ "invoice": params["payment_request"] })
+        await lnmarkets.balance.invalidate()
+        pay = loads(pay) if (pay) else None
+
+    if not (pay) or not (pay.get("payment_hash")):
+        raise JobError(ERRORS["withdraw"])
+    await database.run(settle_withdraw, job, pay["payment_hash"])
+
+def settle_withdraw(job: dict, payment_hash: str):
+    params = job["params"]
+    with database.atomic():
+        tx = database.Transaction.create(
+            txid=payment_hash,
+            username=job["username"],
+            destination=job["username"],
+            currency="BTC",
+            value=database.to_units("BTC", params["amount_sat"]),
+            fee=database.to_units("BTC", params["fee_sat"]),
+            status="settled",
+            typeof="withdraw"
+        )
+        if not (database.finish_job(job["id"], ["paying"], "settled", tx.to_dict())):
+            raise database.StaleJob(job["id"])
+
+# Work done from each step, until the job is settled.
+STEPS = {
+    "swap": { "debited": swap_top_up, "paid": swap_execute, "batched": swap_batch },
+    "withdraw": { "debited": withdraw_pay }
+}
+
+async def run(job: dict):
+    """Run the steps of `job` from where its journal stands."""
+    try:
+        while (job["step"] in STEPS[job["type"]]):
+            await STEPS[job["type"]][job["step"]](job)
+    except JobError as error:
+        await compensate(job, str(error))
+    except database.StaleJob:
+        logging.warning(f"Job {job['id']} was moved on elsewhere.")
+    except JobPending:
+        logging.warning(f"Job {job['id']} is pending at {job['step']}, left for recovery.")
+    except Exception as error:
+        if (job["step"] in SAFE_STEPS):
+            await compensate(job, ERRORS[job["type"]])
+        else:
+            logging.error(f"Job {job['id']} failed at {job['step']}, left for recovery: {error}")
+    finally:
+        await reads.bump(job["username"])
+
+async def execute(job: dict):
+    try:
+        await run(job)
+    finally:
+        tasks.pop(job["id"], None)
+        await aredis.delete(f"stable.job.{job['id']}")
+
+async def create(username: str, typeof: str, step: str, params: dict, currency: str, amount: int) -> dict:
+    """Debit `amount` and journal a job at `step`, returns it or None when
+    the balance does not cover it. The job runs once launched.
+    """
+    job = { "id": token_hex(16), "username": username, "type": typeof, "step": step, "params": dict(params, in_asset=currency, debited=amount) }
+    if not (await database.run(database.open_job, job["id"], username, typeof, step, job["params"], currency, amount)):
+        return None
+    
+    # Keeps the recovery worker of other processes off the job.
+    await aredis.set(f"stable.job.{job['id']}", 1, ex=JOB_STALE_AFTER)
+    return job
+
+def launch(job: dict) -> str:
+    tasks[job["id"]] = asyncio.create_task(execute(job))
+    return job["id"]
+
+async def submit(username: str, typeof: str, step: str, params: dict, currency: str, amount: int) -> str:
+    """Create and launch a job, returns its id or None when the balance does
+    not cover it.
+    """
+    job = await create(username, typeof, step, params, currency, amount)
+    return launch(job) if (job) else None
+
+async def get(jobid: str, wait: float = 0) -> dict:
+    """Job by id, waiting up to `wait` seconds for it to finish."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    if (jobid in tasks) and (wait > 0):
+        # Running here, no need to read the journal before it is done.
+        await asyncio.wait([tasks[jobid]], timeout=wait)
+    
+    job = await database.run(database.get_job, jobid)
+    while (job) and (job["status"] == "running") and (loop.time() < deadline):
+        await asyncio.sleep(min(0.5, deadline - loop.time()))
+        job = await database.run(database.get_job, jobid)
+    return job
+
+async def resume(job: dict) -> bool:
+    """Resume or compensate a job left running by a stopped worker. 
+    Returns False when it has to be checked again later.
+    """
+    step = job["step"]
+    params = job["params"]
+    if (step in SAFE_STEPS):
+        await compensate(job, ERRORS[job["type"]])
+    elif (step == "paid"):
+        await run(job)
+    elif (step == "paying") and ((job["type"] == "swap") or (params["wallet"] == "lnbits")):
+        # The payment hash was journaled before paying, LNbits knows how it went.
+        payment = await alnbits.get_payment(params["payment_hash"])
+        details = payment.get("details", {})
+        if (payment.get("paid") == True) and (job["type"] == "swap"):
+            await swap_paid(job, round(abs(float(details.get("fee", 0))) / 1000))
+            await run(job)
+        elif (payment.get("paid") == True):
+            await database.run(settle_withdraw, job, params["payment_hash"])
+        elif (details.get("pending") == False):
+            await compensate(job, ERRORS[job["type"]])
+        elif (job["created_at"] > datetime.now() - timedelta(seconds=JOB_REVIEW_AFTER)):
+            return False
+        else:
+            await review(job)
+    else:
+        await review(job)
+    return True
+
+async def recover() -> int:
+    """Resume or compensate every stale job, returns how many were handled."""
+    handled = 0
+    for job in await database.run(database.stale_jobs, datetime.now() - timedelta(seconds=JOB_STALE_AFTER)):
+        if (job["id"] in tasks) or not (await aredis.set(f"stable.job.{job['id']}", 1, nx=True, ex=JOB_STALE_AFTER)):
+            continue
+
+        try:
+            if (await resume(job)):
+                handled += 1
+        except Exception as error:
+            logging.error(f"Unable to recover job {job['id']}: {error}")
+        finally:
+            await aredis.delete(f"stable.job.{job['id']}")
+            await reads.bump(job["username"])
+    return handled
+
+async def worker():
+    while True:
+        try:
+            handled = await recover()
+            if (handled):
+                logging.info(f"Recovered {handled} interrupted jobs.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logging.error(f"Job recovery failed: {error}")
+
+        await asyncio.sleep(JOB_RECOVERY_INTERVAL)
+
+def start():
+    global task
+    if (JOB_RECOVERY_INTERVAL > 0):
+        task = asyncio.create_task(worker())
+
+async def stop():
+    """Let the jobs of this process finish before shutting down."""
+    if (task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    if (tasks):
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
@@ -0,0 +1,101 @@
+from configs import LNM_NETWORK, LNM_WS_URL, PRICE_FEED, PRICE_MAX_AGE
+from services.lnmarkets import alnmarkets
+from services.redis import redis, aredis
+from lnmarkets.rest import get_hostname
+from threading import Thread, Event
+from json import dumps, loads
+from time import time
+
+import websocket
+import logging
+
+CHANNELS = ["futures:btc_usd:index", "futures:btc_usd:last-price"]
+
+# Latest (index, last price, received at), replaced as a whole by the 
+# feed thread so the event loop always reads a consistent tuple.
+latest = (None, None, 0)
+
+stopping = Event()
+thread = None
+socket = None
+published = 0
+
+def publish():
+    """Share the latest prices with the other workers, at most once a second."""
+    global published
+    if (time() - published < 1):
+        return
+    
+    published = time()
+    index, last_price, updated_at = latest
+    try:
+        redis.set("stable.prices.ticker", dumps({ "index": index, "lastPrice": last_price, "updated_at": updated_at }), ex=PRICE_MAX_AGE)
+    except Exception as error:
+        logging.warning(f"Unable to publish prices: {error}")
+
+def on_open(ws):
+    ws.send(dumps({ "jsonrpc": "2.0", "id": "prices", "method": "v1/public/subscribe", "params": CHANNELS }))
+
+def on_message(ws, message: str):
+    global latest
+    message = loads(message)
+    if (message.get("method") != "subscription"):
+        return
+    
+    channel = message["params"]["channel"]
+    data = message["params"]["data"]
+    index, last_price, _ = latest
+    if (channel == "futures:btc_usd:index"):
+        latest = (float(data["index"]), last_price, time())
+    elif (channel == "futures:btc_usd:last-price"):
+        latest = (index, float(data["lastPrice"]), time())
+    else:
+        return
+    publish()
+
+def run():
+    global socket
+    url = LNM_WS_URL or f"wss://{get_hostname(LNM_NETWORK)}"
+    delay = 1
+    while not (stopping.is_set()):
+        socket = websocket.WebSocketApp(url, on_open=on_open, on_message=on_message)
+        started = time()
+        try:
+            socket.run_forever(ping_interval=20, ping_timeout=10)
+        except Exception as error:
+            logging.warning(f"Price feed failed: {error}")
+        
+        # Reconnect with a backoff that resets once a connection held up.
+        delay = 1 if (time() - started > 60) else min(delay * 2, 30)
+        stopping.wait(delay)
+
+async def get_index() -> float:
+    """USD per BTC, from the feed in memory when it is fresh, otherwise
+    from the price shared by another worker or the REST ticker.
+    """
+    global latest
+    index, last_price, updated_at = latest
+    if (index) and (time() - updated_at <= PRICE_MAX_AGE):
+        return index
+    
+    shared = await aredis.get("stable.prices.ticker")
+    if (shared):
+        shared = loads(shared)
+        if (shared["index"]) and (time() - shared["updated_at"] <= PRICE_MAX_AGE):
+            return shared["index"]
+    
+    index = float(loads(await alnmarkets.futures_get_ticker())["index"])
+    latest = (index, last_price, time())
+    return index
+
+def start():
+    global thread
+    if (PRICE_FEED == True):
+        stopping.clear()
+        thread = Thread(target=run, name="prices", daemon=True)
+        thread.start()
+
+async def stop():
+    stopping.set()
+    if (socket):
+        socket.close()
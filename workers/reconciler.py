@@ -0,0 +1,121 @@
+from configs import RECONCILE_INTERVAL, RECONCILE_PAGE_SIZE, RECONCILE_MAX_PAGES, DEPOSIT_EXPIRY
+from services.lnbits import alnbits
+from services.redis import aredis
+from services import lnbits, pending, reads
+from helpers import timestamp
+
+import database
+import logging
+import asyncio
+
+task = None
+
+async def fetch_payments(payment_hashes: set, since: int) -> dict:
+    """Page through the most recent LNbits payments and index the settled
+    incoming ones by payment hash. Stops once every hash is found or the
+    pages are older than `since`.
+    """
+    payments = {}
+    offset = 0
+    for _ in range(RECONCILE_MAX_PAGES):
+        page = await alnbits.list_payments(limit=RECONCILE_PAGE_SIZE, offset=offset)
+        for payment in page:
+            if (payment.get("pending") == False) and (int(payment["amount"]) > 0):
+                payments[payment["payment_hash"]] = payment
+        
+        offset += len(page)
+        if (len(page) < RECONCILE_PAGE_SIZE) or (payment_hashes <= payments.keys()):
+            break
+        
+        if (min([payment.get("time", 0) for payment in page]) < since):
+            break
+    return payments
+
+async def lookup(payment_hash: str) -> dict:
+    try:
+        return await alnbits.get_payment(payment_hash)
+    except Exception as error:
+        logging.warning(f"Unable to look up deposit {payment_hash}: {error}")
+        return None
+
+async def confirm_expired(payment_hashes: list) -> tuple:
+    """Look expired deposits up by hash. Returns the unpaid ones and the
+    (payment hash, amount msat) of the paid ones, deposits LNbits could
+    not answer for are left pending until the next sweep.
+    """
+    unpaid = []
+    paid = []
+    for payment_hash, payment in zip(payment_hashes, await asyncio.gather(*[lookup(payment_hash) for payment_hash in payment_hashes])):
+        if not (isinstance(payment, dict)):
+            continue
+        
+        if (payment.get("paid") == True):
+            paid.append((payment_hash, abs(int(payment["details"]["amount"]))))
+        elif (payment.get("paid") == False):
+            unpaid.append(payment_hash)
+    return (unpaid, paid)
+
+async def reconcile(payment_hashes: list = None) -> dict:
+    """Settle the pending deposits found paid in one bulk fetch of LNbits
+    payments, and cancel the ones whose invoice has expired. Without
+    `payment_hashes` every pending deposit is reconciled.
+    """
+    deposits = await database.run(database.pending_deposits, payment_hashes)
+    
+    # Deposits created before the ledger tracked pending rows only exist in Redis.
+    if (payment_hashes):
+        missing = [payment_hash for payment_hash in payment_hashes if not (payment_hash in deposits)]
+        for payment_hash, tx in (await pending.get_many(missing)).items():
+            deposits[payment_hash] = (tx["username"], tx["created_at"])
+    
+    if not (deposits):
+        return { "settled": [], "canceled": [] }
+    
+    since = min([created_at for _, created_at in deposits.values()])
+    payments = await fetch_payments(set(deposits.keys()), since)
+    
+    paid = []
+    expired = []
+    for payment_hash, (username, created_at) in deposits.items():
+        if (payment_hash in payments):
+            paid.append((username, payment_hash, int(payments[payment_hash]["amount"])))
+        elif (created_at + DEPOSIT_EXPIRY < timestamp()):
+            expired.append(payment_hash)
+    
+    # Missing from the pages fetched is no proof an expired deposit was
+    # never paid, each one is confirmed by hash before it is canceled.
+    expired, confirmed = await confirm_expired(expired)
+    paid.extend([(deposits[payment_hash][0], payment_hash, amount) for payment_hash, amount in confirmed])
+    
+    settled = await database.run(database.settle_deposits, paid) if (paid) else []
+    canceled = await database.run(database.cancel_deposits, expired) if (expired) else []
+    await pending.delete_many(settled + canceled)
+    await reads.bump(*[deposits[payment_hash][0] for payment_hash in settled + canceled])
+    if (settled):
+        await lnbits.balance.invalidate()
+    return { "settled": settled, "canceled": canceled }
+
+async def worker():
+    while True:
+        try:
+            # A single process sweeps per interval.
+            if (await aredis.set("stable.reconciler.lock", 1, nx=True, ex=RECONCILE_INTERVAL)):
+                result = await reconcile()
+                if (result["settled"]) or (result["canceled"]):
+                    logging.info(f"Reconciled {len(result['settled'])} settled and {len(result['canceled'])} canceled deposits.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logging.error(f"Reconciliation failed: {error}")
+        
+        await asyncio.sleep(RECONCILE_INTERVAL)
+
+def start():
+    global task
+    if (RECONCILE_INTERVAL > 0):
+        task = asyncio.create_task(worker())
+
+async def stop():
+    if (task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,190 @@
+from configs import SWAP_BATCH_WINDOW, SATS
+from services.lnmarkets import alnmarkets
+from services import lnmarkets
+from workers import treasury, prices
+from secrets import token_hex
+from json import loads
+
+import telemetry
+import database
+import logging
+import asyncio
+
+entries = []
+flushing = None
+tasks = set()
+
+class SwapPending(Exception):
+    """The batch was sent upstream but its outcome is unknown, so it is
+    neither refunded nor settled here.
+    """
+
+@telemetry.timed("swaps.submit")
+async def submit(username: str, in_asset: str, out_asset: str, value: float, debited: int, quoted: float, jobid: str) -> float:
+    """Queue a swap whose input (plus fee reserve) was already debited by
+    the job `jobid`. Resolves with the amount credited in `out_asset` once
+    the batch the swap belongs to has been executed, or `quoted` when it 
+    was locked by a quote.
+    """
+    global flushing
+    future = asyncio.get_running_loop().create_future()
+    entries.append({ 
+        "username": username, 
+        "in_asset": in_asset, 
+        "out_asset": out_asset, 
+        "value": value, 
+        "debited": debited, 
+        "quoted": quoted,
+        "job": jobid,
+        "future": future 
+    })
+    if (flushing == None):
+        flushing = asyncio.create_task(flush())
+        tasks.add(flushing)
+        flushing.add_done_callback(tasks.discard)
+    return await future
+
+async def flush():
+    global flushing
+    await asyncio.sleep(SWAP_BATCH_WINDOW / 1000)
+    
+    batch = entries[:]
+    entries.clear()
+    flushing = None
+    try:
+        results = await execute(batch)
+    except SwapPending as error:
+        # The jobs stay at "swapping", recovery leaves them for review.
+        logging.error(f"Swap batch outcome is unknown, left for review: {error}")
+        for entry in batch:
+            if not (entry["future"].done()):
+                entry["future"].set_exception(error)
+    except Exception as error:
+        # Failed before the swap was placed, or LN Markets rejected it.
+        logging.error(f"Unable to execute swap batch: {error}")
+        await database.run(refund, batch)
+        for entry in batch:
+            if not (entry["future"].done()):
+                entry["future"].set_exception(error)
+    else:
+        for entry, out_amount in zip(batch, results):
+            if not (entry["future"].done()):
+                entry["future"].set_result(out_amount)
+
+async def top_up(amount: int) -> int:
+    """Make sure LN Markets holds `amount` sats, paying the missing part 
+    from LNbits. Returns the routing fee paid.
+    """
+    lnmarkets_balance = await lnmarkets.get_balance()
+    if (amount <= lnmarkets_balance):
+        return 0
+    return await treasury.transfer_to_lnmarkets(amount - lnmarkets_balance)
+
+async def execute(batch: list) -> list:
+    """Net the BTC->USD and USD->BTC flows of the batch against each other,
+    swap only the difference upstream and allocate every entry at the 
+    rate of that single execution.
+    """
+    btc_in = sum([entry["value"] for entry in batch if (entry["in_asset"] == "BTC")])
+    usd_in = sum([entry["value"] for entry in batch if (entry["in_asset"] == "USD")])
+    
+    # USD per BTC, the index is only used to size the net amount.
+    price = await prices.get_index()
+    net_usd = round(usd_in - (btc_in * price / SATS), 2)
+    if (net_usd < 0):
+        in_asset, out_asset, in_amount = "BTC", "USD", int(round(-net_usd * SATS / price))
+    else:
+        in_asset, out_asset, in_amount = "USD", "BTC", net_usd
+    
+    fee_sat = 0
+    if (in_amount > 0) and (in_asset == "BTC"):
+        fee_sat = await top_up(in_amount)
+    
+    # Journaled before going upstream, an interrupted batch is left for review.
+    await database.run(database.advance_jobs, [entry["job"] for entry in batch], "batched", "swapping")
+    if (in_amount > 0):
+        try:
+            swap = loads(await alnmarkets.swap({ "in_asset": in_asset, "out_asset": out_asset, "in_amount": in_amount }))
+        except Exception as error:
+            # A timeout or an unreadable answer, the swap may have gone through.
+            raise SwapPending(str(error))
+        
+        if not (swap.get("exchange_rate")):
+            raise Exception("It was not possible to swap the exchange.")
+    
+    # From here on the swap went through, nothing is refunded.
+    try:
+        if (in_amount > 0):
+            await lnmarkets.balance.invalidate()
+            if (in_asset == "BTC"):
+                price = float(swap["out_amount"]) * SATS / in_amount
+            else:
+                price = in_amount * SATS / float(swap["out_amount"])
+        
+        results, fees = allocate(batch, price, fee_sat, btc_in)
+        await database.run(settle, batch, results, fees)
+    except Exception as error:
+        raise SwapPending(f"Swapped upstream but not settled: {error}")
+    return results
+
+def allocate(batch: list, price: float, fee_sat: int, btc_in: int) -> tuple:
+    """Amount credited and routing fee charged to every entry."""
+    results = []
+    fees = []
+    for entry in batch:
+        if (entry["quoted"] != None):
+            results.append(entry["quoted"])
+            fees.append(round(fee_sat * entry["value"] / btc_in) if (entry["in_asset"] == "BTC") else 0)
+        elif (entry["in_asset"] == "BTC"):
+            results.append(round(entry["value"] * price / SATS, 2))
+            fees.append(round(fee_sat * entry["value"] / btc_in))
+        else:
+            results.append(int(entry["value"] * SATS / price))
+            fees.append(0)
+    return (results, fees)
+
+def settle(batch: list, results: list, fees: list):
+    with database.atomic():
+        for entry, out_amount, fee_sat in zip(batch, results, fees):
+            username = entry["username"]
+            in_asset = entry["in_asset"]
+            out_asset = entry["out_asset"]
+            if not (database.finish_job(entry["job"], ["swapping"], "settled", { "coins": out_amount, "currency": out_asset })):
+                continue
+
+            # Return what is left of the fee reserve, a routing fee above
+            # it is absorbed rather than taken past the debit.
+            charged = min(database.to_units(in_asset, entry["value"] + fee_sat), entry["debited"])
+            if (entry["debited"] != charged):
+                database.credit(username, in_asset, entry["debited"] - charged)
+            
+            database.credit(username, out_asset, database.to_units(out_asset, out_amount))
+            database.Transaction.create(
+                txid=token_hex(32),
+                username=username,
+                destination=username,
+                currency=in_asset,
+                fee=charged - database.to_units(in_asset, entry["value"]),
+                value=database.to_units(in_asset, entry["value"]),
+                status="settled",
+                typeof="withdraw"
+            )
+            database.Transaction.create(
+                txid=token_hex(32),
+                username=username,
+                destination=username, 
+                currency=out_asset,
+                value=database.to_units(out_asset, out_amount),
+                status="settled",
+                typeof="deposit"
+            )
+
+def refund(batch: list):
+    with database.atomic():
+        for entry in batch:
+            database.compensate_job(entry["job"], ["batched", "swapping"], entry["username"], entry["in_asset"], entry["debited"], "It was not possible to swap the exchange.")
+
+async def stop():
+    """Let the batches already queued execute before shutting down."""
+    if (tasks):
+        await asyncio.gather(*tasks, return_exceptions=True)
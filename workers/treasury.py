@@ -0,0 +1,110 @@
+from configs import TREASURY_INTERVAL, TREASURY_LNMARKETS_TARGET, TREASURY_BAND, TREASURY_MIN_AMOUNT
+from services.lnmarkets import alnmarkets, LNMARKETS_WITHDRAW_MIN
+from services.lnbits import alnbits
+from services.redis import aredis
+from services import lnbits, lnmarkets
+from helpers import timestamp
+from json import dumps, loads
+
+import logging
+import asyncio
+
+task = None
+
+async def transfer_to_lnmarkets(amount: int) -> int:
+    """Pay an LN Markets deposit invoice of `amount` sats from LNbits.
+    Returns the routing fee paid.
+    """
+    payment_request = loads(await alnmarkets.deposit({ "amount": amount }))["paymentRequest"]
+    pay_invoice = await lnbits.pay_invoice(payment_request)
+    await lnbits.balance.invalidate()
+    await lnmarkets.balance.invalidate()
+    if (pay_invoice.get("message")):
+        raise Exception("Unable to transfer to LN Markets.")
+    return pay_invoice["fee_sat"]
+
+async def transfer_to_lnbits(amount: int):
+    """Withdraw `amount` sats from LN Markets to an LNbits invoice."""
+    invoice = await alnbits.create_invoice(amount, memo="Treasury rebalance", webhook="")
+    if not (invoice.get("payment_request")):
+        raise Exception("Unable to create the LNbits invoice.")
+    
+    withdraw = await alnmarkets.withdraw({ "invoice": invoice["payment_request"] })
+    await lnbits.balance.invalidate()
+    await lnmarkets.balance.invalidate()
+    if not (withdraw):
+        raise Exception("Unable to withdraw from LN Markets.")
+
+async def get_state() -> dict:
+    state = await aredis.get("stable.treasury.state")
+    if not (state):
+        return {}
+    return loads(state)
+
+async def rebalance() -> dict:
+    """Move funds so the share held on LN Markets returns to the target
+    whenever it leaves the configured band.
+    """
+    if not (await aredis.set("stable.treasury.running", 1, nx=True, ex=300)):
+        return await get_state()
+    
+    try:
+        return await evaluate()
+    finally:
+        await aredis.delete("stable.treasury.running")
+
+async def evaluate() -> dict:
+    lnmarkets_balance = await lnmarkets.balance.refresh()
+    lnbits_balance = await lnbits.balance.refresh()
+    total = lnmarkets_balance + lnbits_balance
+    share = (lnmarkets_balance / total) if (total > 0) else TREASURY_LNMARKETS_TARGET
+    
+    decision = { "action": "hold", "amount": 0, "created_at": timestamp() }
+    amount = round(abs((TREASURY_LNMARKETS_TARGET * total) - lnmarkets_balance))
+    if (share < TREASURY_LNMARKETS_TARGET - TREASURY_BAND) and (amount >= TREASURY_MIN_AMOUNT):
+        decision.update({ "action": "to_lnmarkets", "amount": amount })
+        decision["fee"] = await transfer_to_lnmarkets(amount)
+    elif (share > TREASURY_LNMARKETS_TARGET + TREASURY_BAND) and (amount >= max(TREASURY_MIN_AMOUNT, LNMARKETS_WITHDRAW_MIN)):
+        decision.update({ "action": "to_lnbits", "amount": amount })
+        await transfer_to_lnbits(amount)
+    
+    state = await get_state()
+    decisions = state.get("decisions", [])
+    if (decision["action"] != "hold"):
+        decisions = ([decision] + decisions)[:50]
+    
+    state = {
+        "lnmarkets": lnmarkets_balance,
+        "lnbits": lnbits_balance,
+        "share": round(share, 4),
+        "target": TREASURY_LNMARKETS_TARGET,
+        "band": TREASURY_BAND,
+        "last": decision,
+        "decisions": decisions,
+        "updated_at": timestamp()
+    }
+    await aredis.set("stable.treasury.state", dumps(state))
+    return state
+
+async def worker():
+    while True:
+        try:
+            # A single worker across all processes rebalances at a time.
+            if (await aredis.set("stable.treasury.lock", 1, nx=True, ex=TREASURY_INTERVAL)):
+                await rebalance()
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logging.error(f"Treasury rebalance failed: {error}")
+        
+        await asyncio.sleep(TREASURY_INTERVAL)
+
+def start():
+    global task
+    if (TREASURY_INTERVAL > 0):
+        task = asyncio.create_task(worker())
+
+async def stop():
+    if (task):
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
@@ -0,0 +1,60 @@
+from configs import WEBHOOK_WORKERS, WEBHOOK_BATCH_SIZE, WEBHOOK_CLAIM_TTL
+from services.redis import aredis
+from workers import reconciler
+
+import logging
+import asyncio
+
+QUEUE = "stable.webhooks"
+
+tasks = []
+
+async def enqueue(payment_hash: str) -> bool:
+    """Claim a webhook delivery and queue it for settlement. Returns False
+    when the same payment is already claimed by an earlier delivery.
+    """
+    if not (await aredis.set(f"stable.webhook.{payment_hash}", 1, nx=True, ex=WEBHOOK_CLAIM_TTL)):
+        return False
+    
+    await aredis.rpush(QUEUE, payment_hash)
+    return True
+
+async def settle(payment_hashes: list):
+    """Reconcile a batch of deliveries against a single bulk fetch of
+    LNbits payments instead of checking every invoice upstream.
+    """
+    result = await reconciler.reconcile(payment_hashes)
+    
+    # Unsettled deliveries release their claim so a later retry is processed.
+    released = [f"stable.webhook.{payment_hash}" for payment_hash in payment_hashes if not (payment_hash in result["settled"])]
+    if (released):
+        await aredis.delete(*released)
+
+async def worker():
+    while True:
+        try:
+            delivery = await aredis.blpop(QUEUE, timeout=1)
+            if not (delivery):
+                continue
+            
+            deliveries = [delivery[1]]
+            if (WEBHOOK_BATCH_SIZE > 1):
+                deliveries.extend(await aredis.lpop(QUEUE, WEBHOOK_BATCH_SIZE - 1) or [])
+            
+            await settle(list(set([delivery.decode() for delivery in deliveries])))
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            logging.error(f"Webhook worker failed: {error}")
+            await asyncio.sleep(1)
+
+def start():
+    for _ in range(WEBHOOK_WORKERS):
+        tasks.append(asyncio.create_task(worker()))
+
+async def stop():
+    for task in tasks:
+        task.cancel()
+    
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()